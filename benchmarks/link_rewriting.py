@@ -0,0 +1,133 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare the single-pass link rewriter with the previous chain of passes.
+
+Previously links were processed by every converter a page went through (the
+page itself, its includes and the template) and then versioned by three more
+regular expression passes. Now `cms.converters.process_links` does all of
+that in one scan of the final document.
+
+Usage: python benchmarks/link_rewriting.py [--links N] [--repeat N]
+"""
+
+import argparse
+import logging
+import os
+import re
+import sys
+import timeit
+from posixpath import relpath
+
+import markupsafe
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from cms.converters import process_links  # noqa: E402
+from cms.sources import create_source  # noqa: E402
+
+SITE_PATH = os.path.join(os.path.dirname(__file__), os.pardir, 'tests',
+                         'test_site')
+
+LINKS = [
+    '<a href="translate">Translate</a>',
+    '<a href="foo/bar" title="Bar">Bar</a>',
+    '<a href="https://example.com/">External</a>',
+    '<img src="/img/icon" alt="">',
+    '<script src="/scripts/myscript.js"></script>',
+    '<link rel="stylesheet" href="/dist/css/main.min.css">',
+    '<a href="#top">Top</a>',
+]
+
+LEGACY_VERSIONED_LINK_REGEXES = [
+    r'(<script\s[^<>]*\bsrc=")(/[^"<>]+)',
+    r'(<link\s[^<>]*\bhref=")(/[^"<>]+)',
+    r'(<img\s[^<>]*\bsrc=")(/[^"<>]+)',
+]
+
+
+def legacy_process_links(text, params):
+    def process_link(match):
+        pre, attr, url, post = match.groups()
+        url = markupsafe.Markup(url).unescape()
+
+        locale, new_url = params['source'].resolve_link(
+            url, params['locale'], params['page'],
+        )
+        if new_url is not None:
+            url = new_url
+            if attr == 'href':
+                post += ' hreflang="{}"'.format(
+                    markupsafe.Markup.escape(locale),
+                )
+
+        if params['relative'] and url.startswith('/'):
+            current_page = '/{}/{}'.format(params['locale'], params['page'])
+            url = relpath(url, current_page.rsplit('/', 1)[0])
+
+        return ''.join((pre, markupsafe.Markup.escape(url), post))
+
+    return re.sub(r'(<[\w]+\s[^<>]*\b(href|src)=\")([^<>\"]+)(\")',
+                  process_link, text)
+
+
+def legacy_chain(text, params, version):
+    # The body was rewritten by the page converter (always with absolute
+    # links) and then once more as part of the template.
+    text = legacy_process_links(text, dict(params, relative=False))
+    text = legacy_process_links(text, params)
+    for regex in LEGACY_VERSIONED_LINK_REGEXES:
+        text = re.sub(regex, r'\1\2?' + version, text)
+    return text
+
+
+def single_pass(text, params, version):
+    return process_links(text, params, lambda url: version)
+
+
+def make_document(count):
+    body = '\n'.join('<p>Paragraph {} {}</p>'.format(i, LINKS[i % len(LINKS)])
+                     for i in range(count))
+    return '<html><head></head><body>\n{}\n</body></html>'.format(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--links', type=int, default=5000,
+                        help='Number of links in the generated document')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of times each variant is run')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    source = create_source(SITE_PATH, cached=True)
+    document = make_document(args.links)
+
+    for relative in (False, True):
+        params = {'source': source, 'locale': 'de', 'page': 'foo/bar',
+                  'relative': relative}
+        expected = legacy_chain(document, params, '1')
+        assert single_pass(document, params, '1') == expected
+
+        print('{} links, relative={}:'.format(args.links, relative))
+        for name, func in [('legacy chain', legacy_chain),
+                           ('single pass', single_pass)]:
+            timer = timeit.Timer(lambda: func(document, params, '1'))
+            best = min(timer.repeat(args.repeat, 1))
+            print('  {:<14}{:8.2f} ms'.format(name, best * 1000))
+
+
+if __name__ == '__main__':
+    main()
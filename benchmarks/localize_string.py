@@ -0,0 +1,135 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare ways of inserting tag attributes into localized strings.
+
+The localized strings of all pages of a website (the test site by default)
+are collected, along with the attributes of their whitelisted tags. Then
+the attributes are inserted with the regular expressions previously built
+for every string, and with `cms.converters.WhitelistedTags`.
+
+Usage: python benchmarks/localize_string.py [--repeat N] [website]
+"""
+
+import argparse
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import timeit
+
+import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from cms.converters import WhitelistedTags, get_whitelisted_tags  # noqa: E402
+from cms.sources import create_source  # noqa: E402
+from cms.utils import process_page  # noqa: E402
+
+SITE_PATH = os.path.join(os.path.dirname(__file__), os.pardir, 'tests',
+                         'test_site')
+
+
+def legacy_insert_attributes(text, tags, escapes, attributes):
+    def re_escape(s):
+        return re.escape(''.join(escapes.get(c, c) for c in s))
+
+    for tag in tags:
+        allowed_contents = '(?:[^<>]|{})'.format('|'.join(
+            '<(?:{}[^<>]*?|/{})>'.format(t, t)
+            for t in map(re.escape, set(tags) - {tag})
+        ))
+        pattern = r'{}({}*?){}'.format(re_escape('<{}>'.format(tag)),
+                                       allowed_contents,
+                                       re_escape('</{}>'.format(tag)))
+        for attrs in attributes.get(tag, []):
+            text = re.sub(
+                pattern,
+                lambda match: '<{}{}>{}</{}>'.format(tag, attrs,
+                                                     match.group(1), tag),
+                text, 1, flags=re.S,
+            )
+        text = re.sub(pattern, r'<{}>\1</{}>'.format(tag, tag), text,
+                      flags=re.S)
+    return text
+
+
+def collect_strings(path):
+    """Render all pages, recording the arguments of attribute insertion."""
+    strings = []
+    orig_insert_attributes = WhitelistedTags.insert_attributes
+
+    def insert_attributes(self, text, attributes):
+        strings.append((self, text, attributes))
+        return orig_insert_attributes(self, text, attributes)
+
+    source = create_source(path, cached=True)
+    with mock.patch.object(WhitelistedTags, 'insert_attributes',
+                           insert_attributes):
+        for page, format in source.list_pages():
+            for locale in sorted(source.list_locales()):
+                try:
+                    process_page(source, locale, page, format)
+                except Exception:
+                    pass
+    return strings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('path', nargs='?', default=SITE_PATH,
+                        help='Path of the website')
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='Number of times the strings are processed')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Rendering pages writes to the cache directory of the website
+        path = os.path.join(tmpdir, 'site')
+        shutil.copytree(args.path, path)
+        strings = collect_strings(path)
+
+    def run_legacy():
+        for tags, text, attributes in strings:
+            legacy_insert_attributes(text, tags.tags, tags.escapes,
+                                     attributes)
+
+    def run_current():
+        for tags, text, attributes in strings:
+            # Includes looking up the precompiled patterns, as done for
+            # every string by `localize_string`.
+            tags = get_whitelisted_tags(tags.tags,
+                                        frozenset(tags.escapes.items()))
+            tags.insert_attributes(text, attributes)
+
+    for tags, text, attributes in strings:
+        assert (tags.insert_attributes(text, attributes) ==
+                legacy_insert_attributes(text, tags.tags, tags.escapes,
+                                         attributes))
+
+    print('{} localized strings:'.format(len(strings)))
+    for name, func in [('regexes per string', run_legacy),
+                       ('precompiled', run_current)]:
+        best = min(timeit.repeat(func, number=args.repeat, repeat=5))
+        print('  {:<20}{:8.2f} us per string'.format(
+            name, best / args.repeat / len(strings) * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare ways of finding translatable string markers in large pages.
+
+Markdown pages of various sizes are generated, with translatable strings
+(some of them with comments and nested strings) in between paragraphs. The
+markers are then found with the regular expression previously used by
+`Converter.insert_localized_strings` and with
+`cms.converters.find_string_markers`.
+
+Usage: python benchmarks/string_markers.py [--repeat N]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from cms.converters import find_string_markers  # noqa: E402
+
+LEGACY_REGEX = re.compile(
+    r'{{\s*([\w\-]+)(?:(?:\[(.*?)\])?\s+'
+    r'((?:(?!{{).|{{(?:(?!}}).)*}})*?))?}}',
+    flags=re.S,
+)
+
+PARAGRAPH = ('Lorem ipsum dolor sit amet, [consectetur](/adipiscing) elit, '
+             'sed do *eiusmod* tempor incididunt ut labore et dolore magna '
+             'aliqua.\n\n')
+
+MARKERS = [
+    '{{title-%(i)d Title number %(i)d}}\n\n',
+    '{{para-%(i)d[A paragraph of text] %(text)s}}\n\n',
+    '{{link-%(i)d Read {{link-text-%(i)d more}} here}}\n\n',
+    '{{ empty-%(i)d }}\n\n',
+]
+
+
+def make_page(paragraphs):
+    parts = []
+    for i in range(paragraphs):
+        parts.append(PARAGRAPH)
+        marker = MARKERS[i % len(MARKERS)]
+        parts.append(marker % {'i': i, 'text': PARAGRAPH.strip()})
+    return ''.join(parts)
+
+
+def make_unterminated_page(paragraphs):
+    # Without a closing }}, the regex scans the rest of the page for every
+    # ] that could end the comment.
+    return '{{unterminated[comment] ' + PARAGRAPH * paragraphs
+
+
+def legacy(text):
+    return [(match.start(), match.end()) + match.groups()
+            for match in LEGACY_REGEX.finditer(text)]
+
+
+def scanner(text):
+    return list(find_string_markers(text))
+
+
+def benchmark(kind, page, repeat):
+    assert scanner(page) == legacy(page)
+
+    print('{} ({} KB):'.format(kind, len(page) // 1024))
+    for name, func in [('regex', legacy), ('scanner', scanner)]:
+        timer = timeit.Timer(lambda: func(page))
+        best = min(timer.repeat(repeat, 1))
+        print('  {:<10}{:10.2f} ms'.format(name, best * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of times each variant is run')
+    args = parser.parse_args()
+
+    for paragraphs in (10, 100, 1000):
+        benchmark('{} paragraphs with markers'.format(paragraphs),
+                  make_page(paragraphs), args.repeat)
+        benchmark('{} paragraphs after an unterminated marker'.format(
+            paragraphs,
+        ), make_unterminated_page(paragraphs), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,18 +14,32 @@
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import re
-import codecs
-import configparser
+import functools
+import hashlib
+import html
+import json
 import logging
+import multiprocessing
 from argparse import ArgumentParser
 import shutil
+import stat
+import urllib.parse
 
-from cms.utils import get_page_params, process_page
-from cms.sources import create_source
+from cms.converters import include_renders
+from cms.utils import get_translation_ratio, page_contents, process_page
+from cms.sources import create_source, log_unresolved_links
 
 MIN_TRANSLATED = 0.3
 
+# Number of pages handed to a worker process at once in parallel builds
+CHUNK_SIZE = 16
+
+# Size of the chunks in which static files are copied and hashed
+COPY_CHUNK_SIZE = 2 ** 20
+
+# Incremented whenever changes to the CMS invalidate previous build records
+BUILD_RECORD_VERSION = 2
+
 
 def ensure_dirs(partial_path, path_parts):
     """Create an entire path of directories.
@@ -66,11 +80,10 @@ def ensure_dirs(partial_path, path_parts):
     ensure_dirs(os.path.join(partial_path, path_parts[0]), path_parts[1:])
 
 
-def is_in_previous_version(path, new_contents, encoding):
-    """Test if a file we try to create already is in the output directory.
+def clear_output_path(path):
+    """Make sure that a file can be written to a path of the output.
 
-    It tests if the pre-existent file has all the expected content.
-    It also handles the following two cases:
+    It handles the following two cases:
 
     1. The path is a directory - If this happens, it removes the directory from
     the file tree.
@@ -80,18 +93,7 @@ def is_in_previous_version(path, new_contents, encoding):
     Parameters
     ----------
     path: str
-        The path we want to test for existence.
-    new_contents: bytes
-        The contents we want to write to the file in the new version of the
-        website.
-    encoding: str
-        The encoding to open the file in (if the path exists and is a file.
-
-    Returns
-    -------
-    bool
-        True - if the file exists and has the same contents.
-        False - if the path doesn't exist/ is not a file.
+        The path we want to write to.
 
     Raises
     ------
@@ -99,95 +101,570 @@ def is_in_previous_version(path, new_contents, encoding):
         If the path exists, but is neither a file, nor a directory.
 
     """
-    if os.path.isfile(path):
-        with codecs.open(path, 'rb', encoding=encoding) as handle:
-            if handle.read() == new_contents:
-                return True
-    elif os.path.isdir(path):
+    if os.path.isdir(path):
         shutil.rmtree(path)
-    elif os.path.exists(path):
+    elif os.path.exists(path) and not os.path.isfile(path):
         raise Exception('The object at {} is not recognisable! It is '
                         'neither a file, nor a directory!'.format(path))
 
-    return False
 
+class OutputManifest:
+    """Record of the files in the output directory.
 
-def generate_pages(repo, output_dir, relative=False):
-    known_files = set()
+    For each file written by the previous build the manifest contains its
+    size, modification time and a hash of its contents. This allows skipping
+    writes of unchanged files without reading them back and finding the files
+    that are no longer generated without walking the output directory.
 
-    def write_file(path_parts, contents, binary=False):
-        encoding = None if binary else 'utf-8'
-        outfile = os.path.join(output_dir, *path_parts)
-        if outfile in known_files:
-            logging.warning('File %s has multiple sources', outfile)
-            return
-        known_files.add(outfile)
+    Parameters
+    ----------
+    output_dir: str
+        The output directory.
+    path: str
+        The path of the manifest file.
+
+    """
 
-        if is_in_previous_version(outfile, contents, encoding):
+    def __init__(self, output_dir, path):
+        self.output_dir = output_dir
+        self.path = path
+        self.entries = {}
+        self.previous = {}
+        self.loaded = False
+        try:
+            with open(path) as handle:
+                previous = json.load(handle)
+        except (IOError, ValueError):
+            return
+        if isinstance(previous, dict):
+            self.previous = previous
+            self.loaded = True
+
+    def get_path(self, filename):
+        return os.path.join(self.output_dir, *filename.split('/'))
+
+    def _stat(self, filename):
+        try:
+            st = os.stat(self.get_path(filename))
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    def is_unchanged(self, filename, digest=None, source_signature=None):
+        """Check if the output file is still the same as in the manifest.
+
+        Parameters
+        ----------
+        filename: str
+            Path of the file relative to the output directory, using forward
+            slashes as separator.
+        digest: str
+            Hash of the new contents of the file.
+        source_signature: str
+            For files that are copied from the source: signature of the
+            source file (see `cms.sources.Source.get_file_signature`). Can be
+            given instead of `digest`.
+
+        Returns
+        -------
+        bool
+            True if the file wasn't modified since the previous build and its
+            contents have the given hash or were copied from the same
+            version of the source file.
+
+        """
+        entry = self.previous.get(filename)
+        if entry is None:
+            return False
+        if digest is not None and entry[2] != digest:
+            return False
+        if source_signature is not None and (
+                len(entry) < 4 or entry[3] != source_signature):
+            return False
+        return self._stat(filename) == entry[:2]
+
+    def keep(self, filename):
+        """Keep the entry of an output file that wasn't written."""
+        if filename in self.previous:
+            self.entries[filename] = self.previous[filename]
+
+    def update(self, filename, digest, source_signature=None):
+        """Record an output file that was written."""
+        self.entries[filename] = (self._stat(filename) +
+                                  [digest, source_signature])
+
+    def get_unknown(self):
+        """Return the files of the previous build that weren't generated."""
+        return [filename for filename in self.previous
+                if filename not in self.entries]
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+        with open(tmp_path, 'w') as handle:
+            json.dump(self.entries, handle)
+        os.replace(tmp_path, self.path)
+
+
+def get_file_digest(path):
+    """Calculate the hash of a file without loading it into memory."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_file(src, dst):
+    """Copy a file without reading its contents into memory.
+
+    `copy_file_range()` is used where supported, which copies the data inside
+    of the kernel (or even shares it between both files on file systems that
+    support reflinks). Otherwise `shutil.copyfile` uses `sendfile()` if
+    possible.
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                         COPY_CHUNK_SIZE):
+                    pass
             return
+        except OSError:
+            # Not supported by the kernel or file system, e.g. when copying
+            # between different file systems with older kernels.
+            pass
+    shutil.copyfile(src, dst)
 
-        ensure_dirs(output_dir, path_parts[:-1])
 
-        with codecs.open(outfile, 'wb', encoding=encoding) as handle:
-            handle.write(contents)
+def replace_file(path, create):
+    """Atomically replace a file in the output directory.
 
-    with create_source(repo, cached=True) as source:
-        config = source.read_config()
-        defaultlocale = config.get('general', 'defaultlocale')
-        locales = list(source.list_locales())
-        if defaultlocale not in locales:
-            locales.append(defaultlocale)
+    The new file is created under a temporary name and then moved into
+    place. This makes sure that output files that are hard links to source
+    files are never modified in place.
 
-        # First pass: compile the list of pages with given translation level
-        def get_locale_file(page):
+    Parameters
+    ----------
+    path: str
+        The path of the file.
+    create: callable
+        Called with the temporary path to create the new file there.
+
+    """
+    dirname, basename = os.path.split(path)
+    tmp_name = '.{}.{}.tmp'.format(basename, os.getpid())
+    tmp_path = os.path.join(dirname, tmp_name)
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        create(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def publish_file(src, dst, hardlink=False):
+    """Publish a file from the source to the output directory.
+
+    Parameters
+    ----------
+    src: str
+        The path of the source file.
+    dst: str
+        The path of the output file.
+    hardlink: bool
+        Whether to create a hard link to the source file instead of copying
+        it. Copying is used as fallback if that's not possible, e.g. because
+        source and output are on different file systems.
+
+    """
+    def create(tmp_path):
+        if hardlink:
             try:
-                return config.get('locale_overrides', page)
-            except configparser.Error:
-                return page
+                os.link(src, tmp_path)
+                return
+            except OSError:
+                pass
+        copy_file(src, tmp_path)
 
-        pagelist = set()
-        blacklist = set()
-        for page, format in source.list_pages():
-            for locale in locales:
-                if locale == defaultlocale:
-                    pagelist.add((locale, page))
-                else:
-                    params = get_page_params(source, locale, page, format)
-                    if params['translation_ratio'] >= MIN_TRANSLATED:
-                        pagelist.add((locale, page))
-                    else:
-                        blacklist.add((locale, get_locale_file(page)))
+    replace_file(dst, create)
+
+
+def get_static_fingerprint(source, url):
+    """Return the fingerprint of the static file a URL points to.
+
+    None is returned if the URL doesn't point to a static file of the source.
+    """
+    url = urllib.parse.urlsplit(html.unescape(url))
+    if url.scheme or url.netloc:
+        return None
+    filename = urllib.parse.unquote(url.path).lstrip('/')
+    if not source.has_static(filename):
+        return None
+    return source.get_static_fingerprint(filename)
+
+
+class PageRenderer:
+    """Render the pages of a website for static generation.
+
+    Every worker process of a parallel build holds its own instance (and
+    therefore its own cached source), so that caches stay warm across all the
+    pages rendered by that worker.
+
+    Parameters
+    ----------
+    source: cms.sources.Source
+        The (cached) source of the website.
+    relative: bool
+        Whether to generate relative links.
+    track_dependencies: bool
+        Whether to return the signatures of the source files that each
+        result depends on (see `cms.sources.DependencyTracker`), otherwise
+        None is returned in their place. Results also come with the links
+        that couldn't be resolved (see `Source.pop_unresolved_links`).
+    version: str
+        The version that is added to the links to static files. If None,
+        links are versioned with the fingerprints of the files instead.
+
+    """
+
+    def __init__(self, source, relative=False, track_dependencies=False,
+                 version=None):
+        self.source = source
+        self.relative = relative
+        self.track_dependencies = track_dependencies
+        self.version = version
+        self.config = source.read_config()
+        self.blacklist = set()
 
         # Override existance check to avoid linking to pages we don't generate
         orig_has_locale = source.has_locale
 
         def has_locale(locale, page):
-            page = get_locale_file(page)
-            if (locale, page) in blacklist:
+            page = self.config.get_locale_file(page)
+            if (locale, page) in self.blacklist:
                 return False
             return orig_has_locale(locale, page)
         source.has_locale = has_locale
-        source.resolve_link.cache_clear()
 
-        # Second pass: actually generate pages this time
-        for locale, page in pagelist:
-            pagedata = process_page(source, locale, page, relative=relative)
+    def _run(self, func, *args, **kwargs):
+        if not self.track_dependencies:
+            result = func(*args, **kwargs)
+            return result, None, self.source.pop_unresolved_links()
+
+        tracker = self.source.dependencies
+        with tracker.capture() as dependencies:
+            result = func(*args, **kwargs)
+        return (result, tracker.get_signatures(dependencies),
+                self.source.pop_unresolved_links())
+
+    def set_blacklist(self, blacklist):
+        """Set the (locale, locale file) pairs that won't be generated."""
+        if blacklist != self.blacklist:
+            self.blacklist.clear()
+            self.blacklist.update(blacklist)
+            # Pages and includes converted before link to pages that are
+            # not generated
+            self.source.resolve_link.cache_clear()
+            page_contents.clear()
+            include_renders.clear()
+
+    def get_translation_ratio(self, locale, page, format):
+        return self._run(get_translation_ratio, self.source, locale, page,
+                         format)
+
+    def get_version(self, url):
+        if self.version is not None:
+            return self.version
+        return get_static_fingerprint(self.source, url)
+
+    def _render_page(self, locale, page):
+        return process_page(self.source, locale, page, relative=self.relative,
+                            get_link_version=self.get_version)
+
+    def render_page(self, locale, page, blacklist):
+        self.set_blacklist(blacklist)
+        return self._run(self._render_page, locale, page)
+
+
+_worker_renderer = None
 
-            # Make sure links to static files are versioned
-            pagedata = re.sub(r'(<script\s[^<>]*\bsrc="/[^"<>]+)', r'\1?%s' % source.version, pagedata)
-            pagedata = re.sub(r'(<link\s[^<>]*\bhref="/[^"<>]+)', r'\1?%s' % source.version, pagedata)
-            pagedata = re.sub(r'(<img\s[^<>]*\bsrc="/[^"<>]+)', r'\1?%s' % source.version, pagedata)
 
-            write_file([locale] + page.split('/'), pagedata)
+def _init_worker(repo, relative, track_dependencies, version):
+    global _worker_renderer
+    source = create_source(repo, cached=True, indexed=True)
+    _worker_renderer = PageRenderer(source, relative, track_dependencies,
+                                    version)
+
+
+def _get_translation_ratio(args):
+    return _worker_renderer.get_translation_ratio(*args)
+
+
+def _render_page(args):
+    return _worker_renderer.render_page(*args)
+
+
+def get_build_cache_path(source, output_dir, name):
+    """Return the path of a file with information about an output directory.
+
+    These files (e.g. the build record and the output manifest) are kept in
+    the cache directory of the source.
+    """
+    key = hashlib.sha1(os.path.abspath(output_dir).encode('utf-8'))
+    return os.path.join(source.get_cache_dir(), 'builds', key.hexdigest(),
+                        name)
+
+
+def load_build_record(path, options):
+    """Load the record of the previous build used for incremental builds.
+
+    The record contains the signatures of the dependencies of every
+    translation ratio and every page generated by the previous build (see
+    `cms.sources.DependencyTracker`), along with the list of pages that were
+    not generated because of insufficient translation.
+
+    Parameters
+    ----------
+    path: str
+        The path of the record.
+    options: dict
+        The options of the current build. The record is only used if the
+        previous build was made with the same options.
+
+    Returns
+    -------
+    dict
+        The record or an empty record if the previous one can't be used.
+
+    """
+    record = {'options': options, 'ratios': {}, 'pages': {}, 'blacklist': []}
+    try:
+        with open(path) as handle:
+            previous = json.load(handle)
+    except (IOError, ValueError):
+        return record
+
+    if isinstance(previous, dict) and previous.get('options') == options:
+        record.update(previous)
+    return record
+
+
+def save_build_record(path, record):
+    tmp_path = path + '.tmp'
+    os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+    with open(tmp_path, 'w') as handle:
+        json.dump(record, handle)
+    os.replace(tmp_path, path)
+
+
+def generate_pages(repo, output_dir, relative=False, jobs=1,
+                   incremental=False, fingerprint=False, hardlink=False):
+    # Pages that aren't rendered again keep the version of the static files
+    # they link to, so it must only change along with the files.
+    if incremental:
+        fingerprint = True
+
+    known_files = set()
+
+    def register_file(path_parts):
+        outfile = os.path.join(output_dir, *path_parts)
+        if outfile in known_files:
+            logging.warning('File %s has multiple sources', outfile)
+            return None
+        known_files.add(outfile)
+        manifest.keep('/'.join(path_parts))
+        return outfile
+
+    def write_file(path_parts, contents, binary=False):
+        outfile = register_file(path_parts)
+        if outfile is None:
+            return
+
+        if not binary:
+            contents = contents.encode('utf-8')
+        filename = '/'.join(path_parts)
+        digest = hashlib.sha1(contents).hexdigest()
+        if manifest.is_unchanged(filename, digest):
+            return
+
+        clear_output_path(outfile)
+        ensure_dirs(output_dir, path_parts[:-1])
+
+        def create(tmp_path):
+            with open(tmp_path, 'wb') as handle:
+                handle.write(contents)
+
+        replace_file(outfile, create)
+        manifest.update(filename, digest)
+
+    def copy_source_file(path_parts, source_filename):
+        outfile = register_file(path_parts)
+        if outfile is None:
+            return
+
+        filename = '/'.join(path_parts)
+        signature = source.get_file_signature(source_filename)
+        if manifest.is_unchanged(filename, source_signature=signature):
+            return
+
+        # The source file was modified since it was copied, e.g. touched by a
+        # version control system, but its contents might still be the same.
+        src = source.get_path(source_filename)
+        digest = get_file_digest(src)
+        if not manifest.is_unchanged(filename, digest):
+            clear_output_path(outfile)
+            ensure_dirs(output_dir, path_parts[:-1])
+            publish_file(src, outfile, hardlink)
+        manifest.update(filename, digest, signature)
+
+    with create_source(repo, cached=True, indexed=True) as source:
+        config = source.read_config()
+        defaultlocale = config.defaultlocale
+        locales = list(source.list_locales())
+        if defaultlocale not in locales:
+            locales.append(defaultlocale)
+
+        manifest = OutputManifest(
+            output_dir, get_build_cache_path(source, output_dir,
+                                             'manifest.json'),
+        )
+        record_path = get_build_cache_path(source, output_dir, 'record.json')
+        options = {
+            'version': BUILD_RECORD_VERSION,
+            'output_dir': os.path.abspath(output_dir),
+            'relative': relative,
+            'fingerprint': fingerprint,
+        }
+        record = {'options': options, 'ratios': {}, 'pages': {},
+                  'blacklist': []}
+        if incremental:
+            previous = load_build_record(record_path, options)
+        else:
+            previous = dict(record)
+
+        def is_up_to_date(dependencies):
+            return (dependencies is not None and
+                    source.dependencies.is_up_to_date(dependencies))
+
+        # All pages of a build share the same version unless fingerprints
+        # of the static files are used.
+        version = None if fingerprint else source.version
+
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs, _init_worker,
+                                        (repo, relative, incremental, version))
+            get_translation_ratios = functools.partial(
+                pool.imap, _get_translation_ratio, chunksize=CHUNK_SIZE,
+            )
+            render_pages = functools.partial(pool.imap, _render_page,
+                                             chunksize=CHUNK_SIZE)
+        else:
+            pool = None
+            renderer = PageRenderer(source, relative, incremental, version)
+
+            def get_translation_ratios(tasks):
+                for task in tasks:
+                    yield renderer.get_translation_ratio(*task)
+
+            def render_pages(tasks):
+                for task in tasks:
+                    yield renderer.render_page(*task)
+
+        unresolved_links = {}
+
+        def add_unresolved_links(links):
+            for page, source_pages in links.items():
+                unresolved_links.setdefault(page, set()).update(source_pages)
+
+        try:
+            # First pass: compile the list of pages with given translation
+            # level
+            ratios = {}
+            tasks = []
+            for page, format in source.list_pages():
+                for locale in locales:
+                    if locale == defaultlocale:
+                        ratios[locale, page] = 1
+                        continue
+
+                    key = '/'.join([locale, page])
+                    ratio, dependencies = previous['ratios'].get(key,
+                                                                 (0, None))
+                    if is_up_to_date(dependencies):
+                        ratios[locale, page] = ratio
+                        record['ratios'][key] = ratio, dependencies
+                    else:
+                        tasks.append((locale, page, format))
+
+            for (locale, page, format), (ratio, dependencies, links) in zip(
+                    tasks, get_translation_ratios(tasks)):
+                ratios[locale, page] = ratio
+                record['ratios']['/'.join([locale, page])] = (ratio,
+                                                              dependencies)
+                add_unresolved_links(links)
+
+            pagelist = []
+            blacklist = set()
+            for (locale, page), ratio in ratios.items():
+                if ratio >= MIN_TRANSLATED:
+                    pagelist.append((locale, page))
+                else:
+                    blacklist.add((locale, config.get_locale_file(page)))
+
+            # Pages can link to each other, so if the set of pages that are
+            # not generated changed, all pages need to be rendered again.
+            record['blacklist'] = sorted(blacklist)
+            if record['blacklist'] != [tuple(item) for item in
+                                       previous['blacklist']]:
+                previous['pages'] = {}
+
+            # Second pass: actually generate pages this time
+            tasks = []
+            blacklist = frozenset(blacklist)
+            for locale, page in sorted(pagelist):
+                path_parts = [locale] + page.split('/')
+                key = '/'.join(path_parts)
+                dependencies = previous['pages'].get(key)
+                outfile = os.path.join(output_dir, *path_parts)
+                if is_up_to_date(dependencies) and os.path.isfile(outfile):
+                    register_file(path_parts)
+                    record['pages'][key] = dependencies
+                else:
+                    tasks.append((locale, page, blacklist))
+
+            for (locale, page, _), (pagedata, dependencies, links) in zip(
+                    tasks, render_pages(tasks)):
+                path_parts = [locale] + page.split('/')
+                write_file(path_parts, pagedata)
+                record['pages']['/'.join(path_parts)] = dependencies
+                add_unresolved_links(links)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        log_unresolved_links(unresolved_links)
 
         for filename in source.list_localizable_files():
             for locale in locales:
                 if source.has_localizable_file(locale, filename):
-                    filedata = source.read_localizable_file(locale, filename)
-                    write_file([locale] + filename.split('/'), filedata, binary=True)
+                    copy_source_file(
+                        [locale] + filename.split('/'),
+                        source.localizable_file_filename(locale, filename),
+                    )
 
         for filename in source.list_static():
-            write_file(filename.split('/'), source.read_static(filename), binary=True)
+            copy_source_file(filename.split('/'),
+                             source.static_filename(filename))
+
+        if incremental:
+            save_build_record(record_path, record)
 
     def remove_unknown(dir):
         files = os.listdir(dir)
@@ -199,7 +676,29 @@ def generate_pages(repo, output_dir, relative=False):
                 remove_unknown(path)
                 if not os.listdir(path):
                     os.rmdir(path)
-    remove_unknown(output_dir)
+
+    def remove_from_manifest(filename):
+        path = manifest.get_path(filename)
+        if os.path.isfile(path) and path not in known_files:
+            os.remove(path)
+
+        # Remove the directories that became empty
+        path_parts = filename.split('/')[:-1]
+        while path_parts:
+            path = os.path.join(output_dir, *path_parts)
+            if not os.path.isdir(path) or os.listdir(path):
+                break
+            os.rmdir(path)
+            path_parts.pop()
+
+    # Without a manifest from the previous build we don't know which files
+    # were generated, so the whole output directory has to be checked.
+    if manifest.loaded:
+        for filename in manifest.get_unknown():
+            remove_from_manifest(filename)
+    else:
+        remove_unknown(output_dir)
+    manifest.save()
 
 
 if __name__ == '__main__':
@@ -208,5 +707,25 @@ if __name__ == '__main__':
     parser.add_argument('output', help='Path to desired output directory')
     parser.add_argument('--relative', help='Generate relative links',
                         action='store_true')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of worker processes used to render '
+                             'pages (default: 1)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only render pages whose source files changed '
+                             'since the previous build (implies '
+                             '--fingerprint)')
+    parser.add_argument('--fingerprint', action='store_true',
+                        help='Version links to static files with hashes of '
+                             'their contents')
+    parser.add_argument('--hardlink', action='store_true',
+                        help='Publish static and localizable files as hard '
+                             'links to the source files where possible')
     args = parser.parse_args()
-    generate_pages(args.source, args.output, args.relative)
+
+    # Worker processes need to find the functions they run by their module
+    # name, which they can't when this file is executed as __main__.
+    from cms.bin import generate_static_pages
+    generate_static_pages.generate_pages(args.source, args.output,
+                                         args.relative, args.jobs,
+                                         args.incremental, args.fingerprint,
+                                         args.hardlink)
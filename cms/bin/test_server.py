@@ -15,17 +15,60 @@
 
 
 import os
+import re
+import collections
 import mimetypes
 import argparse
+import email.utils
+import gzip
+import hashlib
+import io
+import time
+import zlib
 
 import jinja2
 
+from cms import utils
 from cms.converters import converters
 from cms.utils import process_page
-from cms.sources import create_source
+from cms.sources import create_source, log_unresolved_links
 
 UNICODE_ENCODING = 'utf-8'
 
+# Maximal number and total size of the responses kept in memory
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_BYTES = 2 ** 26
+
+# Number of bytes read at once when sending static files
+STATIC_CHUNK_SIZE = 2 ** 16
+
+# A single byte range as given in the `Range` header, multiple ranges
+# aren't supported
+BYTE_RANGE_REGEX = re.compile(r'bytes=(\d*)-(\d*)$')
+
+# Responses of these types, and all text types, are sent compressed to
+# clients that accept it
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'application/xhtml+xml',
+    'application/rss+xml',
+    'application/atom+xml',
+    'image/svg+xml',
+}
+
+COMPRESSION_LEVEL = 6
+
+# Maximal number of responses whose ETag and modification time are kept,
+# allowing to answer conditional requests without keeping the response
+VALIDATOR_CACHE_SIZE = 2 ** 14
+
+# The signatures of the files a response was generated from, the ETag of
+# the response and the time it was last modified (in seconds since epoch)
+Validators = collections.namedtuple('Validators',
+                                    ['signatures', 'etag', 'last_modified'])
+
 ERROR_TEMPLATE = '''
 <html>
   <head>
@@ -52,6 +95,171 @@ mimetypes.init([])
 mimetypes.add_type('image/svg+xml', '.svg')
 
 
+def is_compressible(mime):
+    return mime.startswith('text/') or mime in COMPRESSIBLE_TYPES
+
+
+def accepts_gzip(header):
+    """Check if gzip is an acceptable encoding according to a request.
+
+    Parameters
+    ----------
+    header: str
+        The value of the `Accept-Encoding` header.
+
+    Returns
+    -------
+    bool
+        True if gzip (or any encoding) is listed with a non-zero quality.
+
+    """
+    qualities = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    for coding in ['gzip', 'x-gzip', '*']:
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def parse_byte_range(header, size):
+    """Parse the `Range` header of a request for a file.
+
+    Parameters
+    ----------
+    header: str
+        The value of the `Range` header.
+    size: int
+        The size of the requested file.
+
+    Returns
+    -------
+    (start, stop): (int, int)
+        The range of bytes requested, or None if the whole file should be
+        sent, i.e. if the header is invalid or not supported.
+
+    Raises
+    ------
+    ValueError
+        If the range is outside of the file.
+
+    """
+    match = BYTE_RANGE_REGEX.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        stop = min(int(last) + 1, size) if last else size
+    elif last:
+        # The last bytes of the file
+        start, stop = max(size - int(last), 0), size
+    else:
+        return None
+
+    if start >= stop:
+        raise ValueError('Range not satisfiable')
+    return start, stop
+
+
+class FileChunks:
+    """Iterate over a range of a file in chunks, for use as WSGI response.
+
+    Parameters
+    ----------
+    file: file-like object
+        The file, opened in binary mode. It's closed along with the
+        response.
+    start: int
+        The position of the first byte to send.
+    stop: int
+        The position after the last byte to send.
+    compress: bool
+        Whether to send the range compressed with gzip.
+
+    """
+
+    def __init__(self, file, start, stop, compress=False):
+        self._file = file
+        self._start = start
+        self._stop = stop
+        self._compress = compress
+
+    def __iter__(self):
+        compressor = None
+        if self._compress:
+            compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+
+        self._file.seek(self._start)
+        remaining = self._stop - self._start
+        while remaining > 0:
+            chunk = self._file.read(min(remaining, STATIC_CHUNK_SIZE))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+
+        if compressor is not None:
+            yield compressor.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ConflictIndex:
+    """The pages and localizable files of a website, indexed by name.
+
+    Pages conflict if there are other pages or localizable files with the
+    same name, or if their name is a directory of another one. Checking
+    this only takes a lookup per directory of the page's name.
+
+    Parameters
+    ----------
+    names: iterable
+        The names of all pages (in any format) and localizable files.
+
+    """
+
+    def __init__(self, names):
+        self._counts = collections.Counter(names)
+        # The directories of all names, e.g. `foo` and `foo/bar` for a
+        # page `foo/bar/baz`
+        self._dirs = set()
+        for name in self._counts:
+            pos = name.find('/')
+            while pos >= 0:
+                self._dirs.add(name[:pos])
+                pos = name.find('/', pos + 1)
+
+    def has_conflicts(self, page):
+        if self._counts[page] > 1 or page in self._dirs:
+            return True
+        pos = page.find('/')
+        while pos >= 0:
+            if page[:pos] in self._counts:
+                return True
+            pos = page.find('/', pos + 1)
+        return False
+
+
 class DynamicServerHandler:
     """General-purpose WSGI server handler that generates pages on request.
 
@@ -69,11 +277,19 @@ class DynamicServerHandler:
     def __init__(self, host, port, source_dir):
         self.host = host
         self.port = port
-        self.source = create_source(source_dir)
+        self.source = create_source(source_dir, indexed=True)
         self.full_url = 'http://{0}:{1}'.format(host, port)
+        self._responses = utils.Cache(RESPONSE_CACHE_SIZE,
+                                      RESPONSE_CACHE_BYTES)
+        self._validators = utils.Cache(VALIDATOR_CACHE_SIZE)
+        # Changes the ETags of generated pages when the server is restarted,
+        # as the CMS itself might have changed
+        self._etag_salt = os.urandom(16)
+        # The config and index version the conflict index was built for
+        self._conflict_index = None, None, None
 
     def _get_data(self, path):
-        """Read the data corresponding to a website path.
+        """Generate the page or read the localizable file for a path.
 
         Parameters
         ----------
@@ -86,9 +302,6 @@ class DynamicServerHandler:
             The data corresponding to the path we're trying to access.
 
         """
-        if self.source.has_static(path):
-            return self.source.read_static(path)
-
         page, data = self._get_page(path)
 
         if page and self._has_conflicts(page):
@@ -96,6 +309,262 @@ class DynamicServerHandler:
 
         return data
 
+    def _get_validators(self, path):
+        """Return the validators of a response that is still up to date.
+
+        Parameters
+        ----------
+        path: str
+            The path of the response.
+
+        Returns
+        -------
+        Validators
+            The validators of the response, or None if it wasn't generated
+            yet or any of the files it was generated from changed.
+
+        """
+        validators = self._validators.get(path)
+        if validators is not None:
+            if self.source.dependencies.is_up_to_date(validators.signatures):
+                return validators
+            # The outdated validators are kept until the response is
+            # generated again, see `_get_response`.
+            self._responses.pop(path)
+            self._responses.pop((path, 'gzip'))
+        return None
+
+    def _update_validators(self, path, signatures, etag):
+        """Cache the validators of a response that was generated again."""
+        last_modified = int(time.time())
+        previous = self._validators.pop(path)
+        if previous is not None:
+            if previous.etag == etag:
+                last_modified = previous.last_modified
+            elif last_modified <= previous.last_modified:
+                # Last-Modified only has a resolution of seconds, but must
+                # change along with the response.
+                last_modified = previous.last_modified + 1
+        validators = Validators(signatures, etag, last_modified)
+        return self._validators.setdefault(path, validators)
+
+    def _get_response(self, path, validators=None):
+        """Read the data for a website path, reusing earlier responses.
+
+        Responses are cached along with the signatures (modification time
+        and size) of the source files they were generated from, and are
+        returned until any of these files changes.
+
+        Parameters
+        ----------
+        path: str
+            The path to the page to get the data for.
+        validators: Validators
+            The validators for the path, if already looked up by
+            `_get_validators`.
+
+        Returns
+        -------
+        (data, validators): (str or bytes, Validators)
+            Both are None if there is no data for the path.
+
+        """
+        if validators is None:
+            validators = self._get_validators(path)
+        if validators is not None:
+            cached = self._responses.get(path)
+            if cached is not None and cached[1] is validators:
+                return cached
+
+        tracker = self.source.dependencies
+        with tracker.capture() as dependencies:
+            data = self._get_data(path)
+        if data is None:
+            return None, None
+
+        # Generated pages are identified by the files they were generated
+        # from, which allows to validate them without generating them again.
+        signatures = tracker.get_signatures(dependencies)
+        digest = hashlib.sha1(self._etag_salt)
+        for dependency in sorted(signatures):
+            digest.update('\0{}\0{}'.format(
+                dependency, signatures[dependency],
+            ).encode(UNICODE_ENCODING))
+        validators = self._update_validators(
+            path, signatures, '"{}"'.format(digest.hexdigest()),
+        )
+        self._responses.pop(path)
+        return self._responses.setdefault(path, (data, validators))
+
+    def _get_compressed(self, path, data, validators):
+        """Compress a response with gzip, reusing earlier results.
+
+        Compressed responses are cached along with the uncompressed ones,
+        and are valid for as long as these are.
+        """
+        key = path, 'gzip'
+        cached = self._responses.get(key)
+        if cached is not None and cached[1] is validators:
+            return cached[0]
+
+        compressed = gzip.compress(data, COMPRESSION_LEVEL, mtime=0)
+        self._responses.pop(key)
+        return self._responses.setdefault(key, (compressed, validators))[0]
+
+    def _send_static(self, environ, start_response, path, mime,
+                     validators=None, encoding=None, compress=False,
+                     vary=False):
+        """Send a static file, or the range of it requested.
+
+        The file is streamed rather than read into memory, using the
+        `wsgi.file_wrapper` of the server if available.
+
+        Parameters
+        ----------
+        environ: dict
+            The environment of the request.
+        start_response: function
+            The function to initiate the response with.
+        path: str
+            The path of the static file.
+        mime: str
+            The content type of the response.
+        validators: Validators
+            The validators for the path, if already looked up by
+            `_get_validators`.
+        encoding: str
+            The content encoding of the response, i.e. `gzip` if the file
+            is compressed already or has to be compressed.
+        compress: bool
+            Whether to compress the file while sending it.
+        vary: bool
+            Whether the response depends on the encodings the client
+            accepts.
+
+        Returns
+        -------
+        iterable of bytes
+            The response body.
+
+        """
+        tracker = self.source.dependencies
+        with tracker.capture() as dependencies:
+            file = self.source.open_static(path)
+
+        try:
+            if validators is None:
+                # Static files are identified by their contents, so that their
+                # ETags stay the same across restarts.
+                digest = hashlib.sha1()
+                for chunk in iter(lambda: file.read(STATIC_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                validators = self._update_validators(
+                    path, tracker.get_signatures(dependencies),
+                    '"{}"'.format(digest.hexdigest()),
+                )
+            size = file.seek(0, io.SEEK_END)
+        except Exception:
+            file.close()
+            raise
+
+        headers = self._get_headers(mime, validators, encoding, vary)
+        if compress:
+            # The size of the compressed file isn't known in advance, so it's
+            # always sent completely.
+            start_response('200 OK', headers)
+            return FileChunks(file, 0, size, compress=True)
+
+        headers.append(('Accept-Ranges', 'bytes'))
+        byte_range = None
+        if 'HTTP_RANGE' in environ and \
+                self._is_range_current(environ, validators, encoding):
+            try:
+                byte_range = parse_byte_range(environ['HTTP_RANGE'], size)
+            except ValueError:
+                file.close()
+                headers.append(('Content-Range', 'bytes */{}'.format(size)))
+                start_response('416 Range Not Satisfiable', headers)
+                return []
+
+        if byte_range is None:
+            headers.append(('Content-Length', str(size)))
+            start_response('200 OK', headers)
+            file_wrapper = environ.get('wsgi.file_wrapper')
+            if file_wrapper is not None:
+                file.seek(0)
+                return file_wrapper(file, STATIC_CHUNK_SIZE)
+            return FileChunks(file, 0, size)
+
+        start, stop = byte_range
+        headers.append(('Content-Range',
+                        'bytes {}-{}/{}'.format(start, stop - 1, size)))
+        headers.append(('Content-Length', str(stop - start)))
+        start_response('206 Partial Content', headers)
+        return FileChunks(file, start, stop)
+
+    def _is_range_current(self, environ, validators, encoding=None):
+        """Check the `If-Range` header of a request for a range.
+
+        Ranges are only sent if the client's copy of the file is current,
+        otherwise the whole file is sent.
+        """
+        if_range = environ.get('HTTP_IF_RANGE')
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"'):
+            return if_range == self._get_etag(validators, encoding)
+        last_modified = email.utils.formatdate(validators.last_modified,
+                                               usegmt=True)
+        return if_range == last_modified
+
+    def _is_not_modified(self, environ, validators, encoding=None):
+        """Check if the client's copy of a response is still current.
+
+        The `If-None-Match` header is checked if given, otherwise the
+        `If-Modified-Since` header, following RFC 7232.
+        """
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            etags = [etag.strip() for etag in if_none_match.split(',')]
+            current = self._get_etag(validators, encoding)
+            return '*' in etags or any(
+                (etag[2:] if etag.startswith('W/') else etag) == current
+                for etag in etags
+            )
+
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return validators.last_modified <= since.timestamp()
+
+        return False
+
+    def _get_etag(self, validators, encoding=None):
+        # Each encoding of a response needs an ETag of its own
+        if encoding is None:
+            return validators.etag
+        return '{}-{}"'.format(validators.etag[:-1], encoding)
+
+    def _get_validator_headers(self, validators, encoding=None, vary=False):
+        last_modified = email.utils.formatdate(validators.last_modified,
+                                               usegmt=True)
+        headers = [('ETag', self._get_etag(validators, encoding)),
+                   ('Last-Modified', last_modified)]
+        if vary:
+            headers.append(('Vary', 'Accept-Encoding'))
+        return headers
+
+    def _get_headers(self, mime, validators, encoding=None, vary=False):
+        headers = [('Content-Type', mime)]
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+        return headers + self._get_validator_headers(validators, encoding,
+                                                     vary)
+
     def _get_page(self, path):
         """Construct a page and return its contents.
 
@@ -109,16 +578,16 @@ class DynamicServerHandler:
         (page_name, page_contents): (str, str)
 
         """
+        config = self.source.read_config()
         path = path.strip('/')
         if path == '':
-            locale, page = self.source.read_config().get('general',
-                                                         'defaultlocale'), ''
+            locale, page = config.defaultlocale, ''
         elif '/' in path:
             locale, page = path.split('/', 1)
         else:
             locale, page = path, ''
 
-        default_page = self.source.read_config().get('general', 'defaultpage')
+        default_page = config.defaultpage
         possible_pages = [page, '/'.join([page, default_page]).lstrip('/')]
 
         for page_format in converters.keys():
@@ -136,6 +605,8 @@ class DynamicServerHandler:
         """Check if a page has conflicts.
 
         A page has conflicts if there are other pages with the same name.
+        The names are indexed again whenever files are created or removed
+        (see `ConflictIndex`).
 
         Parameters
         ----------
@@ -149,15 +620,23 @@ class DynamicServerHandler:
             False - otherwise
 
         """
-        pages = [p for p, _ in self.source.list_pages()]
-        pages.extend(self.source.list_localizable_files())
-
-        if pages.count(page) > 1:
-            return True
-        if any(p.startswith(page + '/') or page.startswith(p + '/') for p in
-               pages):
-            return True
-        return False
+        config = self.source.read_config()
+        tracker = self.source.dependencies
+
+        index_config, version, index = self._conflict_index
+        if index is None or index_config is not config or \
+                version is None or version != self.source.index_version:
+            version = self.source.index_version
+            with tracker.ignore():
+                names = [p for p, _ in self.source.list_pages()]
+                names.extend(self.source.list_localizable_files())
+            index = ConflictIndex(names)
+            self._conflict_index = config, version, index
+
+        # Whether there are conflicts depends on all of these files
+        tracker.record('pages/')
+        tracker.record('locales/{}/'.format(config.defaultlocale))
+        return index.has_conflicts(page)
 
     def get_error_page(self, start_response, status, **kw):
         """Create and display an error page.
@@ -212,19 +691,51 @@ class DynamicServerHandler:
         """
         path = environ.get('PATH_INFO')
 
-        data = self._get_data(path)
+        # Pick up pages and other files that were created or removed
+        self.source.refresh()
+
+        # Static files with a `.gz` file next to them are sent compressed
+        # as is, other files are compressed if their type allows it.
+        mime = mimetypes.guess_type(path)[0] or 'text/html'
+        static = self.source.has_static(path)
+        precompressed = static and self.source.has_static(path + '.gz')
+        vary = precompressed or is_compressible(mime)
+        encoding = None
+        if vary and accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING', '')):
+            encoding = 'gzip'
+        if precompressed and encoding is not None:
+            path += '.gz'
+
+        validators = self._get_validators(path)
+        if validators is not None and \
+                self._is_not_modified(environ, validators, encoding):
+            start_response('304 Not Modified', self._get_validator_headers(
+                validators, encoding, vary,
+            ))
+            return []
+
+        if static:
+            return self._send_static(
+                environ, start_response, path, mime, validators, encoding,
+                compress=encoding is not None and not precompressed,
+                vary=vary,
+            )
+
+        data, validators = self._get_response(path, validators)
+        log_unresolved_links(self.source.pop_unresolved_links())
 
         if data is None:
             return self.get_error_page(start_response, '404 Not Found',
                                        uri=path)
 
-        mime = mimetypes.guess_type(path)[0] or 'text/html'
-
         if isinstance(data, str):
             data = data.encode(UNICODE_ENCODING)
             mime = '{0}; charset={1}'.format(mime, UNICODE_ENCODING)
+        if encoding is not None:
+            data = self._get_compressed(path, data, validators)
 
-        start_response('200 OK', [('Content-Type', mime)])
+        start_response('200 OK', self._get_headers(mime, validators, encoding,
+                                                   vary))
         return [data]
 
 
@@ -14,13 +14,23 @@
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import contextlib
+import contextvars
+import hashlib
+import logging
 import os
 import html.parser
 import re
+import threading
 import urllib.parse
+import weakref
 from posixpath import relpath
 
 import jinja2
+import jinja2.bccache
+import jinja2.defaults
+import jinja2.meta
+import jinja2.nodes
 import markdown
 import markupsafe
 
@@ -47,6 +57,94 @@ html_escapes = {
     "'": '&#39;',
 }
 
+# Matches the last href or src attribute of every tag
+link_regex = re.compile(r'(<(\w+)\s[^<>]*\b(href|src)=")([^<>"]+)(")')
+
+# Tags and attributes that link to scripts, stylesheets and images
+versioned_links = {('script', 'src'), ('link', 'href'), ('img', 'src')}
+
+
+def process_links(text, params, get_version=None):
+    """Rewrite the links of an HTML document in a single pass.
+
+    Links to pages and static files are resolved (adding `hreflang` to
+    resolved `href` attributes) and, if `params['relative']` is set, made
+    relative to the current page. Only the last `href` or `src` attribute of
+    each tag is rewritten.
+
+    Parameters
+    ----------
+    text: str
+        The HTML document.
+    params: dict
+        The parameters of the page the document belongs to, as returned by
+        `cms.utils.get_page_params`.
+    get_version: callable
+        Called with the (HTML-escaped) absolute URL of each script,
+        stylesheet and image. Unless it returns None, the version is appended
+        to the URL as query string.
+
+    Returns
+    -------
+    str
+        The document with rewritten links.
+
+    """
+    source = params['source']
+    locale = params['locale']
+    page = params['page']
+    if params['relative']:
+        base_url = '/{}/{}'.format(locale, page).rsplit('/', 1)[0]
+    else:
+        base_url = None
+
+    # The rewritten URL and hreflang only depend on the URL (and whether it
+    # gets versioned) so links used repeatedly are only processed once.
+    rewritten = {}
+
+    def rewrite(url, versioned):
+        url = markupsafe.Markup(url).unescape()
+        link_locale, new_url = source.resolve_link(url, locale, page)
+        if new_url is not None:
+            url = new_url
+            hreflang = ' hreflang="{}"'.format(
+                markupsafe.Markup.escape(link_locale),
+            )
+        else:
+            hreflang = None
+
+        if base_url is not None and url.startswith('/'):
+            url = relpath(url, base_url)
+
+        url = markupsafe.Markup.escape(url)
+        if versioned and get_version and url.startswith('/'):
+            version = get_version(url)
+            if version is not None:
+                url = '{}?{}'.format(url, version)
+        return url, hreflang
+
+    parts = []
+    pos = 0
+    for match in link_regex.finditer(text):
+        pre, tag, attr, url, post = match.groups()
+        key = (url, (tag, attr) in versioned_links)
+        try:
+            url, hreflang = rewritten[key]
+        except KeyError:
+            url, hreflang = rewritten[key] = rewrite(*key)
+
+        parts.extend((text[pos:match.start()], pre, url, post))
+        if hreflang and attr == 'href':
+            parts.append(hreflang)
+        pos = match.end()
+
+    parts.append(text[pos:])
+    return ''.join(parts)
+
+
+# Results of `AttributeParser.parse`, by whitelist and string
+parsed_strings = utils.Cache(maxsize=2 ** 14)
+
 
 class AttributeParser(html.parser.HTMLParser):
     _string = None
@@ -57,8 +155,27 @@ class AttributeParser(html.parser.HTMLParser):
     def __init__(self, whitelist):
         super().__init__(convert_charrefs=True)
         self._whitelist = whitelist
+        self._whitelist_key = frozenset(whitelist)
 
     def parse(self, text, pagename):
+        """Extract the attributes and fixed strings from a default string.
+
+        Returns the string without attributes and fixed strings, the
+        attributes of its whitelisted tags and the fixed strings. The
+        returned values must not be modified, they are cached.
+        """
+        # Without tags and entities there is nothing to parse
+        if '<' not in text and '&' not in text:
+            return text, {}, []
+
+        key = (self._whitelist_key, text)
+        result = parsed_strings.get(key)
+        if result is None:
+            result = parsed_strings.setdefault(key, self._parse(text,
+                                                                pagename))
+        return result
+
+    def _parse(self, text, pagename):
         self.reset()
         self._string = []
         self._fixed_strings = []
@@ -121,6 +238,277 @@ class AttributeParser(html.parser.HTMLParser):
         self._append_text(self.unescape('&#{};'.format(name)))
 
 
+class WhitelistedTags:
+    """Reinserts the attributes of whitelisted tags into localized strings.
+
+    Localized strings contain whitelisted tags without attributes (e.g.
+    `<a>`), after being escaped. The attributes taken from the default string
+    are inserted into these tags in order, by tag name.
+
+    Parameters
+    ----------
+    tags : tuple
+        The whitelisted tag names, in the order in which they're processed.
+    escapes : dict
+        The escapes applied to the localized strings.
+
+    """
+
+    def __init__(self, tags, escapes):
+        def escape(s):
+            return ''.join(escapes.get(c, c) for c in s)
+
+        self.tags = tags
+        self.escapes = escapes
+
+        # Matches a whitelisted tag along with its contents. The contents can
+        # only contain other whitelisted tags, which allows for nested tags.
+        self._patterns = {}
+        for tag in tags:
+            allowed_contents = '(?:[^<>]|{})'.format('|'.join(
+                '<(?:{}[^<>]*?|/{})>'.format(t, t)
+                for t in map(re.escape, sorted(set(tags) - {tag}))
+            ))
+            self._patterns[tag] = re.compile(
+                r'{}({}*?){}'.format(re.escape(escape('<{}>'.format(tag))),
+                                     allowed_contents,
+                                     re.escape(escape('</{}>'.format(tag)))),
+                flags=re.S,
+            )
+
+        # If < and > are escaped, the strings can't contain other markup and
+        # the tags can be paired up from a single scan for (escaped) tags.
+        self._tokens = None
+        if not any(c in escape('<>') for c in '<>'):
+            self._tokens = {}
+            for tag in tags:
+                self._tokens[escape('<{}>'.format(tag))] = tag, False
+                self._tokens[escape('</{}>'.format(tag))] = tag, True
+            self._token_regex = re.compile('|'.join(
+                map(re.escape, sorted(self._tokens, key=len, reverse=True)),
+            ))
+            # Tags (e.g. <abbr>) that start with another tag name (<a>) are
+            # allowed as contents of itself, as far as the patterns go.
+            self._nestable = {tag for tag in tags
+                              if any(t != tag and tag.startswith(t)
+                                     for t in tags)}
+
+    def insert_attributes(self, text, attributes):
+        """Insert attributes into the whitelisted tags of a string.
+
+        Parameters
+        ----------
+        text : str
+            The escaped string.
+        attributes : dict
+            The attributes (as HTML strings) to insert into each occurrence
+            of a tag, in order.
+
+        Returns
+        -------
+        str
+            The string with all whitelisted tags (that are paired up)
+            unescaped and with their attributes.
+
+        """
+        if self._tokens is None or any(
+            self._token_regex.search(attrs)
+            for attr_list in attributes.values() for attrs in attr_list
+        ):
+            return self._insert_sequentially(text, attributes)
+        return self._insert_in_single_pass(text, attributes)
+
+    def _insert_sequentially(self, text, attributes):
+        for tag in self.tags:
+            pattern = self._patterns[tag]
+            for attrs in attributes.get(tag, []):
+                text = pattern.sub(
+                    lambda match: '<{}{}>{}</{}>'.format(tag, attrs,
+                                                         match.group(1), tag),
+                    text, 1,
+                )
+            text = pattern.sub(r'<{}>\1</{}>'.format(tag, tag), text)
+        return text
+
+    def _insert_in_single_pass(self, text, attributes):
+        # [start, end, is_closing, replacement] of the tags, by tag name
+        tokens = {}
+        for match in self._token_regex.finditer(text):
+            tag, closing = self._tokens[match.group(0)]
+            tokens.setdefault(tag, []).append(
+                [match.start(), match.end(), closing, None],
+            )
+        if not tokens:
+            return text
+
+        for tag in self.tags:
+            if tag in tokens:
+                self._pair_tags(tag, tokens[tag], attributes.get(tag, []))
+
+        replaced = sorted(token for tag_tokens in tokens.values()
+                          for token in tag_tokens if token[3] is not None)
+        parts = []
+        pos = 0
+        for start, end, closing, replacement in replaced:
+            parts.append(text[pos:start])
+            parts.append(replacement)
+            pos = end
+        parts.append(text[pos:])
+        return ''.join(parts)
+
+    def _pair_tags(self, tag, tokens, attributes):
+        # This pairs up tags the same way as the regular expressions used by
+        # `_insert_sequentially` would: each opening tag is paired with the
+        # next closing tag, unless a tag that was already inserted is between
+        # them. The tags with attributes are inserted first, then the rest.
+        nestable = tag in self._nestable
+
+        def find_closing(i):
+            for j in range(i + 1, len(tokens)):
+                start, end, closing, replacement = tokens[j]
+                if replacement is not None:
+                    if closing or not nestable:
+                        return None
+                elif closing:
+                    return j
+            return None
+
+        def insert(i, j, attrs):
+            tokens[i][3] = '<{}{}>'.format(tag, attrs)
+            tokens[j][3] = '</{}>'.format(tag)
+
+        for attrs in attributes:
+            for i, token in enumerate(tokens):
+                if not token[2] and token[3] is None:
+                    j = find_closing(i)
+                    if j is not None:
+                        insert(i, j, attrs)
+                        break
+
+        i = 0
+        while i < len(tokens):
+            if not tokens[i][2] and tokens[i][3] is None:
+                j = find_closing(i)
+                if j is not None:
+                    insert(i, j, '')
+                    i = j
+            i += 1
+
+
+@utils.memoize(maxsize=64)
+def get_whitelisted_tags(tags, escapes):
+    """Return the `WhitelistedTags` for tag names and frozen escapes."""
+    return WhitelistedTags(tags, dict(escapes))
+
+
+# The beginning of translatable string markers, up to the string ID
+string_marker_start_regex = re.compile(r'{{\s*([\w\-]+)')
+whitespace_regex = re.compile(r'\s+')
+
+
+def find_string_markers(text):
+    r"""Find the markers of translatable strings in a text.
+
+    Markers have the format `{{ id[comment] default }}`, where the comment
+    and the default (which may contain nested `{{ }}` pairs) are optional.
+    This scans the text in (nearly) linear time, but finds the same markers
+    as the regular expression that was used before:
+
+        {{\s*([\w\-]+)(?:(?:\[(.*?)\])?\s+((?:(?!{{).|{{(?:(?!}}).)*}})*?))?}}
+
+    Yields
+    ------
+    tuple
+        The start and end position, the ID, the comment (None if missing) and
+        the default (None if missing) of each marker, in order.
+
+    """
+    # Where the default text reaching a {{ or }} at a position ends
+    default_ends = {}
+
+    def find_default_end(pos):
+        # Return the position of the }} after a default text starting at
+        # `pos`, -1 if there is none. Nested {{ }} pairs are skipped, a {{
+        # without a matching }} means that there is no default text here.
+        visited = []
+        result = -1
+        while True:
+            closing = text.find('}}', pos)
+            if closing < 0:
+                break
+            opening = text.find('{{', pos, closing)
+            special = closing if opening < 0 else opening
+            if special in default_ends:
+                result = default_ends[special]
+                break
+            visited.append(special)
+            if opening < 0:
+                result = closing
+                break
+            # The first }} after a {{ closes it: continue after that.
+            pos = closing + 2
+        for special in visited:
+            default_ends[special] = result
+        return result
+
+    def match_default(name, start, pos, comment):
+        # Match the whitespace and default text after the ID or comment
+        whitespace = whitespace_regex.match(text, pos)
+        if whitespace:
+            end = find_default_end(whitespace.end())
+            if end >= 0:
+                return (start, end + 2, name, comment,
+                        text[whitespace.end():end])
+        return None
+
+    def match_marker(start):
+        match = string_marker_start_regex.match(text, start)
+        if not match:
+            return None
+        name = match.group(1)
+        pos = match.end()
+
+        if text.startswith('[', pos):
+            # The comment ends with the first ] that leads to a match
+            closing = text.find(']', pos + 1)
+            while closing >= 0:
+                result = match_default(name, start, closing + 1,
+                                       text[pos + 1:closing])
+                if result:
+                    return result
+                closing = text.find(']', closing + 1)
+
+        result = match_default(name, start, pos, None)
+        if result:
+            return result
+        if text.startswith('}}', pos):
+            return start, pos + 2, name, None, None
+        return None
+
+    pos = 0
+    while True:
+        start = text.find('{{', pos)
+        if start < 0:
+            return
+        marker = match_marker(start)
+        if marker:
+            yield marker
+            pos = marker[1]
+        else:
+            pos = start + 1
+
+
+# Rendered includes by source, include and the parameters that are the same
+# for all pages of a build (see `Converter.resolve_includes`)
+include_renders = utils.Cache(maxsize=2 ** 12, weak=True)
+
+# Number of renderings kept per include, e.g. for pages with different
+# translations of its strings
+INCLUDE_VARIANTS = 8
+
+_MISSING = object()
+
+
 class Converter:
     whitelist = {'a', 'em', 'sup', 'strong', 'code', 'span', 'small', 'abbr'}
     missing_translations = 0
@@ -132,13 +520,41 @@ class Converter:
         self._params = params
         self._attribute_parser = AttributeParser(self.whitelist)
         self._seen_defaults = {}
+        # The values that the output depends on, if recorded for caching,
+        # by what was read (see `_get_read_value`)
+        self._reads = None
+        self._uncacheable = False
 
-    @utils.memoize
+    @utils.memoize(maxsize=256, weak=True)
     def _get_locale_data(self, page, locale=None):
         if locale is None:
             locale = self._params['locale']
         return self._params['source'].read_locale(locale, page)
 
+    def _get_read_value(self, read):
+        """Look up a value that the output of the converter depends on.
+
+        Reads are `('param', None, name)` for parameters and
+        `('string', page, name)` for strings of a page in the current and
+        the default locale, the page being None for the current page.
+        """
+        kind, page, name = read
+        if kind == 'param':
+            return self._params.get(name, _MISSING)
+        if page is None:
+            page = self._params['page']
+        defaultlocale = self._params['defaultlocale']
+        return (self._get_locale_data(page).get(name, _MISSING),
+                self._get_locale_data(page, defaultlocale).get(name, _MISSING))
+
+    def _record_read(self, kind, page, name):
+        if self._reads is not None:
+            if kind == 'string' and page == self._params['page']:
+                page = None
+            read = (kind, page, name)
+            if read not in self._reads:
+                self._reads[read] = self._get_read_value(read)
+
     def localize_string(self, page, name, default, comment,
                         escapes, default_required=True):
         """Return translation for a string.
@@ -179,13 +595,11 @@ class Converter:
         def escape(s):
             return ''.join(escapes.get(c, c) for c in s)
 
-        def re_escape(s):
-            return re.escape(escape(s))
-
         locale = self._params['locale']
         localedata = self._get_locale_data(page, locale)
         defaultlocale = self._params['defaultlocale']
         default_localedata = self._get_locale_data(page, defaultlocale)
+        self._record_read('string', page, name)
 
         if default:
             # The default is provided in the page: remember it, in case the
@@ -247,112 +661,118 @@ class Converter:
                 escape(self.insert_localized_strings(value, {})),
             )
 
-        for tag in self.whitelist:
-            allowed_contents = '(?:[^<>]|{})'.format('|'.join(
-                '<(?:{}[^<>]*?|/{})>'.format(t, t)
-                for t in map(re.escape, self.whitelist - {tag})
-            ))
-            saved = saved_attributes.get(tag, [])
-            for attrs in saved:
+        tags = get_whitelisted_tags(tuple(self.whitelist),
+                                    frozenset(escapes.items()))
+        attributes = {}
+        for tag in tags.tags:
+            attributes[tag] = []
+            for attrs in saved_attributes.get(tag, []):
                 attrs = [stringify_attribute(*attr) for attr in attrs]
-                result = re.sub(
-                    r'{}({}*?){}'.format(re_escape('<{}>'.format(tag)),
-                                         allowed_contents,
-                                         re_escape('</{}>'.format(tag))),
-                    lambda match: r'<{}{}>{}</{}>'.format(
-                        tag,
-                        ' ' + ' '.join(attrs) if attrs else '',
-                        match.group(1),
-                        tag,
-                    ),
-                    result, 1, flags=re.S,
-                )
-            result = re.sub(
-                r'{}({}*?){}'.format(re_escape('<{}>'.format(tag)),
-                                     allowed_contents,
-                                     re_escape('</{}>'.format(tag))),
-                r'<{}>\1</{}>'.format(tag, tag),
-                result, flags=re.S,
-            )
-        return result
+                attributes[tag].append(' ' + ' '.join(attrs) if attrs else '')
+        return tags.insert_attributes(result, attributes)
 
     def insert_localized_strings(self, text, escapes, to_html=lambda s: s):
-        def lookup_string(match):
-            name, comment, default = match.groups()
+        parts = []
+        pos = 0
+        for start, end, name, comment, default in find_string_markers(text):
             if default:
                 default = to_html(default).strip()
-            return self.localize_string(self._params['page'], name, default,
-                                        comment, escapes)
+            parts.append(text[pos:start])
+            parts.append(self.localize_string(self._params['page'], name,
+                                              default, comment, escapes))
+            pos = end
 
-        return re.sub(
-            r'{{\s*'
-            r'([\w\-]+)'  # String ID
-            r'(?:(?:\[(.*?)\])?'  # Optional comment
-            r'\s+'
-            r'((?:(?!{{).|'  # Translatable text
-            r'{{(?:(?!}}).)*}}'  # Nested translation
-            r')*?)'
-            r')?'
-            r'}}',
-            lookup_string,
-            text,
-            flags=re.S,
-        )
-
-    def process_links(self, text):
-        def make_relative(base_url, target):
-            if not target.startswith('/'):
-                # Links to an external resource
-                return target
-            return relpath(target, base_url.rsplit('/', 1)[0])
-
-        def process_link(match):
-            pre, attr, url, post = match.groups()
-            url = markupsafe.Markup(url).unescape()
-
-            locale, new_url = self._params['source'].resolve_link(
-                url, self._params['locale'], self._params['page'],
-            )
+        if not parts:
+            return text
+        parts.append(text[pos:])
+        return ''.join(parts)
 
-            if new_url is not None:
-                url = new_url
-                if attr == 'href':
-                    post += ' hreflang="{}"'\
-                        .format(markupsafe.Markup.escape(locale))
-
-            if self._params['relative']:
-                current_page = '/{}/{}'.format(self._params['locale'],
-                                               self._params['page'])
-                url = make_relative(current_page, url)
+    include_start_regex = '<'
+    include_end_regex = '>'
 
-            return ''.join((pre, markupsafe.Markup.escape(url), post))
+    def _convert_include(self, name, format, converter_class, record=False):
+        data, filename = self._params['source'].read_include(name, format)
+
+        # XXX: allowing includes to modify params of the whole page
+        # seems like a bad idea but we have to support this because
+        # it's used by www.adblockplus.org.
+        metadata, rest = utils.extract_page_metadata(data)
+        self._params.update(metadata)
+
+        converter = converter_class(rest, filename, self._params)
+        if record:
+            converter._reads = {}
+        result = converter()
+        self.missing_translations += converter.missing_translations
+        self.total_translations += converter.total_translations
+        return converter, result
+
+    def _merge_reads(self, reads):
+        if self._reads is None:
+            return
+        if reads is None:
+            self._uncacheable = True
+        else:
+            for read, value in reads.items():
+                self._reads.setdefault(read, value)
 
-        text = re.sub(r'(<[\w]+\s[^<>]*\b(href|src)=\")([^<>\"]+)(\")',
-                      process_link, text)
-        return text
+    def _render_include(self, name, format, converter_class):
+        """Convert an include, reusing the output for other pages.
 
-    include_start_regex = '<'
-    include_end_regex = '>'
+        The output is cached along with the parameter values and strings
+        that were read, the changes made to the parameters and the
+        translation counts. It's reused as long as these values and the
+        files it was converted from stay the same.
+        """
+        source = self._params['source']
+        tracker = source.dependencies
+        if tracker is None or self._params['localized_string_callback']:
+            return self._convert_include(name, format, converter_class)[1]
+
+        key = (source, name, format, self._params['locale'],
+               self._params['defaultlocale'], self._params.get('site_url'),
+               bool(self._params.get('translation_ratio_only')))
+        for variant in include_renders.get(key, []):
+            reads, signatures, result, updates, missing, total = variant
+            if all(self._get_read_value(read) == value
+                   for read, value in reads.items()) and \
+                    tracker.is_up_to_date(signatures):
+                tracker.replay(signatures)
+                self._params.update(updates)
+                self.missing_translations += missing
+                self.total_translations += total
+                self._merge_reads(reads)
+                return result
+
+        params = dict(self._params)
+        missing = self.missing_translations
+        total = self.total_translations
+        with tracker.capture() as dependencies:
+            converter, result = self._convert_include(name, format,
+                                                      converter_class, True)
+
+        if converter._uncacheable:
+            self._merge_reads(None)
+            return result
+        self._merge_reads(converter._reads)
+
+        updates = {name: value for name, value in self._params.items()
+                   if params.get(name, _MISSING) is not value}
+        variant = (converter._reads, tracker.get_signatures(dependencies),
+                   result, updates, self.missing_translations - missing,
+                   self.total_translations - total)
+        variants = include_renders.setdefault(key, [])
+        variants.insert(0, variant)
+        del variants[INCLUDE_VARIANTS:]
+        return result
 
     def resolve_includes(self, text):
         def resolve_include(match):
             name = match.group(1)
             for format_, converter_class in converters.items():
                 if self._params['source'].has_include(name, format_):
-                    data, filename = (
-                        self._params['source'].read_include(name, format_))
-
-                    # XXX: allowing includes to modify params of the whole page
-                    # seems like a bad idea but we have to support this because
-                    # it's used by www.adblockplus.org.
-                    metadata, rest = utils.extract_page_metadata(data)
-                    self._params.update(metadata)
-
-                    converter = converter_class(rest, filename, self._params)
-                    result = converter()
-                    self.missing_translations += converter.missing_translations
-                    self.total_translations += converter.total_translations
-                    return result
+                    return self._render_include(name, format_,
+                                                converter_class)
             raise Exception('Failed to resolve include {}'
                             ' on page {}'.format(name, self._params['page']))
 
@@ -372,9 +792,7 @@ class Converter:
 
 class RawConverter(Converter):
     def get_html(self, source, filename):
-        result = self.insert_localized_strings(source, html_escapes)
-        result = self.process_links(result)
-        return result
+        return self.insert_localized_strings(source, html_escapes)
 
 
 class MarkdownConverter(Converter):
@@ -394,99 +812,321 @@ class MarkdownConverter(Converter):
                 return match.group(0)
             return char
 
-        escapes = {}
+        with get_markdown() as md:
+            escapes = {}
+            for char in md.ESCAPED_CHARS:
+                escapes[char] = '&#{};'.format(str(ord(char)))
+            for key, value in html_escapes.items():
+                escapes[key] = value
+
+            result = self.insert_localized_strings(source, escapes,
+                                                   markdown_string_to_html)
+            if self._params.get('translation_ratio_only'):
+                return result
+            result = md.convert(result)
+        return re.sub(r'&#(\d+);', remove_unnecessary_entities, result)
+
+
+# Markdown instances not currently in use, per thread (see `get_markdown`)
+markdown_pool = threading.local()
+
+
+@contextlib.contextmanager
+def get_markdown():
+    """Provide a Markdown instance configured for the CMS.
+
+    Setting up Markdown and its extensions is expensive, so instances are
+    reset and reused by the same thread after the `with` block.
+    """
+    try:
+        instances = markdown_pool.instances
+    except AttributeError:
+        instances = markdown_pool.instances = []
+
+    if instances:
+        md = instances.pop()
+    else:
         md = markdown.Markdown(output='html5', extensions=[
             'markdown.extensions.extra',
         ])
-        for char in md.ESCAPED_CHARS:
-            escapes[char] = '&#{};'.format(str(ord(char)))
-        for key, value in html_escapes.items():
-            escapes[key] = value
-
         md.preprocessors['html_block'].markdown_in_raw = True
 
-        def to_html(s):
-            return re.sub(r'</?p>', '', md.convert(s))
+    try:
+        yield md
+    finally:
+        md.reset()
+        instances.append(md)
 
-        result = self.insert_localized_strings(source, escapes, to_html)
-        result = md.convert(result)
-        result = re.sub(r'&#(\d+);', remove_unnecessary_entities, result)
-        result = self.process_links(result)
-        return result
+
+@utils.memoize(maxsize=2 ** 14)
+def markdown_string_to_html(s):
+    """Convert a translatable string from Markdown to inline HTML."""
+    with get_markdown() as md:
+        return re.sub(r'</?p>', '', md.convert(s))
+
+
+def get_file_signature(source, filename):
+    """Return the signature of a source file (see `Source.get_file_signature`).
+
+    The signatures are memoized by the dependency tracker of cached sources.
+    """
+    if source.dependencies is not None:
+        return source.dependencies.get_signature(filename)
+    return source.get_file_signature(filename)
 
 
 class SourceTemplateLoader(jinja2.BaseLoader):
     def __init__(self, source):
-        self.source = source
+        # Environments are cached per source (see
+        # `create_template_environment`), so they must not keep it alive.
+        self._source = weakref.ref(source)
+
+    @property
+    def source(self):
+        return self._source()
 
     def get_source(self, environment, template):
+        filename = template + '.tmpl'
+        # Taken before reading, so that concurrent changes cause a reload
+        signature = get_file_signature(self.source, filename)
         try:
-            result = self.source.read_file(template + '.tmpl')
+            result = self.source.read_file(filename)
         except Exception:
             raise jinja2.TemplateNotFound(template)
-        return result + (None,)
+
+        def uptodate():
+            # Templates taken from Jinja's cache are still dependencies of
+            # the page using them.
+            if self.source.dependencies is not None:
+                self.source.dependencies.record(filename)
+            return get_file_signature(self.source, filename) == signature
+
+        return result + (uptodate,)
+
+
+class SourceBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """Cache compiled templates in the cache directory of a source.
+
+    Compiled templates are stored under the hash of their name, file name
+    and source, and of the filters and globals of the website (given as
+    `digest`). They are therefore reused across builds and test server
+    restarts, even when switching between versions of a template.
+    """
+
+    # Incremented whenever changes to the CMS invalidate compiled templates
+    version = 1
+
+    def __init__(self, source, digest):
+        directory = os.path.join(source.get_cache_dir(), 'jinja2')
+        jinja2.FileSystemBytecodeCache.__init__(self, directory)
+        self.digest = digest
+
+    def get_bucket(self, environment, name, filename, source):
+        # The file name ends up in tracebacks, so it's part of the key
+        key = '\n'.join([str(self.version), self.digest, name, filename or '',
+                         source])
+        key = hashlib.sha1(key.encode('utf-8'))
+        bucket = jinja2.bccache.Bucket(environment, key.hexdigest(),
+                                       self.get_source_checksum(source))
+        self.load_bytecode(bucket)
+        return bucket
+
+    def dump_bytecode(self, bucket):
+        # Not being able to write to the cache shouldn't break rendering
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            jinja2.FileSystemBytecodeCache.dump_bytecode(self, bucket)
+        except OSError as e:
+            logging.debug('Failed to cache compiled template: %s', e)
+
+
+@utils.memoize(maxsize=256, weak=True)
+def compile_template(env, source, filename):
+    """Compile the source of a template, using the bytecode cache if any."""
+    bcc = env.bytecode_cache
+    if bcc is None:
+        return env.compile(source, None, filename)
+
+    bucket = bcc.get_bucket(env, filename or '<template>', filename, source)
+    if bucket.code is None:
+        bucket.code = env.compile(source, None, filename)
+        bcc.set_bucket(bucket)
+    return bucket.code
+
+
+@utils.memoize(maxsize=256, weak=True)
+def get_template_variables(env, source):
+    """Return the names of the variables a template reads from its context.
+
+    None is returned if the template could access other variables as well,
+    through included or imported templates or filters and globals of the
+    website that are passed the context.
+    """
+    ast = env.parse(source)
+    if any(ast.find_all((jinja2.nodes.Include, jinja2.nodes.Import,
+                         jinja2.nodes.FromImport, jinja2.nodes.Extends))):
+        return None
+
+    functions = [env.filters.get(node.name)
+                 for node in ast.find_all(jinja2.nodes.Filter)]
+    functions.extend(env.globals.get(node.name)
+                     for node in ast.find_all(jinja2.nodes.Name))
+    for func in functions:
+        if func in jinja2.defaults.DEFAULT_FILTERS.values() or \
+                getattr(func, 'converter_filter', False):
+            continue
+        if getattr(func, 'jinja_pass_arg', None) is not None:
+            return None
+    return frozenset(jinja2.meta.find_undeclared_variables(ast))
+
+
+# The template converter being rendered, used by the filters and globals that
+# templates share (see `get_template_environment`)
+current_converter = contextvars.ContextVar('current_converter')
+
+# Methods of `TemplateConverter` available to templates as filters and globals
+converter_filters = ['translate', 'linkify', 'toclist']
+converter_globals = [
+    'get_string',
+    'has_string',
+    'get_page_content',
+    'get_pages_metadata',
+    'get_canonical_url',
+    'get_page_url',
+    'page_has_locale',
+]
+
+
+def call_converter_method(name):
+    """Return a function calling a method of the current template converter."""
+    def call(*args, **kwargs):
+        return getattr(current_converter.get(), name)(*args, **kwargs)
+
+    call.__name__ = name
+    return call
+
+
+def call_converter_filter(name):
+    """Return a filter calling a method of the current template converter.
+
+    Jinja2 calls filters that don't take the context with constant arguments
+    when compiling templates. Since compiled templates are shared by all
+    pages, the output for the page compiled first would be used everywhere.
+    """
+    @jinja2.pass_context
+    def call(context, *args, **kwargs):
+        return getattr(current_converter.get(), name)(*args, **kwargs)
+
+    call.__name__ = name
+    call.converter_filter = True
+    return call
+
+
+@utils.memoize(maxsize=16, weak=True)
+def create_template_environment(source, files):
+    """Create a Jinja2 environment (see `get_template_environment`).
+
+    Returns the environment along with the dependencies recorded while
+    loading the filters and globals of the website.
+    """
+    filters = {name: call_converter_filter(name)
+               for name in converter_filters}
+    globals = {name: call_converter_method(name)
+               for name in converter_globals}
+
+    if source.dependencies is not None:
+        capture = source.dependencies.capture()
+    else:
+        capture = contextlib.nullcontext(set())
+
+    # Jinja2 calls filters of the website while compiling templates, so
+    # compiled templates are only valid for the filters they were compiled
+    # with.
+    digest = hashlib.sha1()
+    with capture as dependencies:
+        for dirname, path, signature in files:
+            dictionary = filters if dirname == 'filters' else globals
+            code, filename = source.read_file(path)
+            digest.update('{}\0{}\0'.format(path, code).encode('utf-8'))
+            namespace = {}
+            exec(compile(code, filename, 'exec'), namespace)
+
+            name = os.path.basename(os.path.splitext(path)[0])
+            try:
+                dictionary[name] = namespace[name]
+            except KeyError:
+                raise Exception('Expected symbol {} not found'
+                                ' in {}'.format(name, path))
+
+    bytecode_cache = SourceBytecodeCache(source, digest.hexdigest())
+    env = jinja2.Environment(loader=SourceTemplateLoader(source),
+                             bytecode_cache=bytecode_cache,
+                             autoescape=True)
+    env.filters.update(filters)
+    env.globals.update(globals)
+    return env, frozenset(dependencies)
+
+
+def get_template_environment(source):
+    """Return the Jinja2 environment for the templates of a source.
+
+    The environment, with the custom filters and globals of the website, is
+    shared by all templates until a file in `filters/` or `globals/` is
+    changed. The filters and globals provided by the CMS are bound to the
+    current `TemplateConverter` when a template is rendered.
+    """
+    tracker = source.dependencies
+    files = []
+    for dirname in ['filters', 'globals']:
+        for filename in source.list_files(dirname):
+            root, ext = os.path.splitext(filename)
+            if ext.lower() != '.py':
+                continue
+
+            path = os.path.join(dirname, filename)
+            if tracker is not None:
+                signature = tracker.get_signature(path)
+            else:
+                signature = source.get_file_signature(path)
+            files.append((dirname, path, signature))
+
+    env, dependencies = create_template_environment(source, tuple(files))
+    if tracker is not None:
+        tracker.replay(dependencies)
+    return env
 
 
 class TemplateConverter(Converter):
     def __init__(self, *args, **kwargs):
         Converter.__init__(self, *args, **kwargs)
-
-        filters = {
-            'translate': self.translate,
-            'linkify': self.linkify,
-            'toclist': self.toclist,
-        }
-
-        globals = {
-            'get_string': self.get_string,
-            'has_string': self.has_string,
-            'get_page_content': self.get_page_content,
-            'get_pages_metadata': self.get_pages_metadata,
-            'get_canonical_url': self.get_canonical_url,
-            'get_page_url': self.get_page_url,
-            'page_has_locale': self.page_has_locale,
-        }
-
-        for dirname, dictionary in [('filters', filters),
-                                    ('globals', globals)]:
-            for filename in self._params['source'].list_files(dirname):
-                root, ext = os.path.splitext(filename)
-                if ext.lower() != '.py':
-                    continue
-
-                path = os.path.join(dirname, filename)
-                namespace = self._params['source'].exec_file(path)
-
-                name = os.path.basename(root)
-                try:
-                    dictionary[name] = namespace[name]
-                except KeyError:
-                    raise Exception('Expected symbol {} not found'
-                                    ' in {}'.format(name, path))
-
-        self._env = jinja2.Environment(
-            loader=SourceTemplateLoader(self._params['source']),
-            autoescape=True)
-        self._env.filters.update(filters)
-        self._env.globals.update(globals)
+        self._env = get_template_environment(self._params['source'])
 
     def get_html(self, source, filename):
         env = self._env
-        code = env.compile(source, None, filename)
+        code = compile_template(env, source, filename)
         template = jinja2.Template.from_code(env, code, env.globals)
 
+        if self._reads is not None:
+            variables = get_template_variables(env, source)
+            if variables is None:
+                self._uncacheable = True
+            else:
+                for name in variables:
+                    self._record_read('param', None, name)
+
+        token = current_converter.set(self)
         try:
             module = template.make_module(self._params)
         except Exception:
             env.handle_exception()
+        finally:
+            current_converter.reset(token)
 
         for key, value in module.__dict__.items():
             if not key.startswith('_'):
                 self._params[key] = value
 
-        result = str(module)
-        result = self.process_links(result)
-        return result
+        return str(module)
 
     def translate(self, default, name, comment=None):
         return markupsafe.Markup(self.localize_string(
@@ -506,12 +1146,14 @@ class TemplateConverter(Converter):
             page = self._params['page']
 
         localedata = self._get_locale_data(page)
+        self._record_read('string', page, name)
         return name in localedata
 
-    def get_page_content(self, page, locale=None):
+    def get_page_content(self, page, locale=None, head_only=False):
         if locale is None:
             locale = self._params['locale']
-        return utils.get_page_params(self._params['source'], locale, page)
+        return utils.get_page_content(self._params['source'], locale, page,
+                                      head_only)
 
     def linkify(self, page, locale=None, **attrs):
         if locale is None:
@@ -530,31 +1172,11 @@ class TemplateConverter(Converter):
         if filters is not None and not isinstance(filters, dict):
             raise TypeError('Filters are not a dictionary')
 
-        return_data = []
-        for page_name, _format in self._params['source'].list_pages():
-            data, filename = self._params['source'].read_page(page_name,
-                                                              _format)
-            page_data = utils.extract_page_metadata(data)[0]
-            page_data.setdefault('page', page_name)
-            if self.filter_metadata(filters, page_data) is True:
-                return_data.append(page_data)
-        return return_data
-
-    def filter_metadata(self, filters, metadata):
-        if filters is None:
-            return True
-        for filter_name, filter_value in list(filters.items()):
-            if filter_name not in metadata:
-                return False
-            if isinstance(metadata[filter_name], list):
-                if isinstance(filter_value, str):
-                    filter_value = [filter_value]
-                for option in filter_value:
-                    if str(option) not in metadata[filter_name]:
-                        return False
-            elif filter_value != metadata[filter_name]:
-                return False
-        return True
+        # Cached sources keep the pages they read for rendering them later,
+        # otherwise reading only their metadata is cheaper.
+        source = self._params['source']
+        index = source.read_pages_metadata(not source.cached)
+        return index.filter(filters)
 
     def get_canonical_url(self, page):
         """Return canonical URL for the page (without locale code)"""
@@ -15,18 +15,528 @@
 
 import io
 import collections
+import collections.abc
 import configparser
+import contextlib
+import functools
+import hashlib
 import json
 import os
-from io import StringIO
+import stat
+import threading
+import time
 from random import randint
 import urllib.parse
 import logging
 
 from cms import utils
 
+# Number of hex digits of the content hash used by `get_static_fingerprint`
+FINGERPRINT_LENGTH = 10
+
+# Number of bytes hashed at once by `get_static_fingerprint`
+HASH_CHUNK_SIZE = 2 ** 20
+
+# Methods of cached sources (see `create_source`) and the limits of their
+# caches, keeping the memory use of builds of large websites bounded
+CACHED_METHODS = {
+    'list_files': {},
+    'list_locales': {},
+    'resolve_link': {'maxsize': 2 ** 16},
+    'read_config': {},
+    'read_pages_metadata': {},
+    'read_template': {},
+    'read_locale': {'maxsize': 2 ** 12},
+    'read_file': {'maxbytes': 2 ** 26},
+    'read_include': {'maxbytes': 2 ** 24},
+    'exec_file': {},
+    'get_static_fingerprint': {'maxsize': 2 ** 16},
+}
+
+# Directories modified less than this long (in nanoseconds) before they were
+# indexed are scanned again on refresh (see `FileSource.refresh`)
+RACY_INTERVAL_NS = 2 * 10 ** 9
+
+# Stored in the index of `FileSource` in place of the modification time of
+# directories that don't exist
+_MISSING_DIR = object()
+
+# Number of characters read at once when only the head of a file is needed
+HEAD_CHUNK_SIZE = 4096
+
+
+class DependencyTracker:
+    """Record which files of a source are accessed.
+
+    Sources report every file existence check, file read and directory
+    listing to their tracker, which collects them for the innermost active
+    `capture()` block (if any). This allows finding out which source files the
+    output of an operation (e.g. rendering a page) depends on.
+
+    Dependencies are represented as file names relative to the source root.
+    Directory listings have a trailing slash (e.g. `pages/`), existence
+    checks that don't depend on the contents of the file have a leading
+    question mark (e.g. `?locales/de/index.json`).
+
+    Parameters
+    ----------
+    source: Source
+        The source whose files are being tracked.
+    cached: bool
+        Whether the contents of the source are expected to change while the
+        tracker is used. If not, file signatures are computed only once.
+
+    """
+
+    def __init__(self, source, cached=False):
+        self._source = source
+        self._local = threading.local()
+        self._signatures = {} if cached else None
+        # The version of the source index and the listing signatures for it
+        self._listings = None, {}
+
+    def _get_frames(self):
+        try:
+            return self._local.frames
+        except AttributeError:
+            self._local.frames = []
+            return self._local.frames
+
+    def record(self, dependency):
+        frames = self._get_frames()
+        if frames:
+            frames[-1].add(dependency)
+
+    def replay(self, dependencies):
+        """Record dependencies that were captured earlier again."""
+        frames = self._get_frames()
+        if frames:
+            frames[-1].update(dependencies)
+
+    @contextlib.contextmanager
+    def capture(self):
+        """Collect dependencies accessed inside of the `with` block.
+
+        Dependencies captured by nested blocks are also added to the
+        enclosing ones.
+        """
+        dependencies = set()
+        frames = self._get_frames()
+        frames.append(dependencies)
+        try:
+            yield dependencies
+        finally:
+            frames.pop()
+            self.replay(dependencies)
+
+    @contextlib.contextmanager
+    def ignore(self):
+        """Don't record dependencies accessed inside of the `with` block."""
+        frames = self._get_frames()
+        frames.append(set())
+        try:
+            yield
+        finally:
+            frames.pop()
+
+    def memoize(self, func, **limits):
+        """Cache results of `func` along with the dependencies they have.
+
+        Cached results don't access any files, so their dependencies are
+        replayed every time the cached value is returned. Keyword arguments
+        limit the size of the cache (see `cms.utils.memoize`).
+        """
+        @utils.memoize(**limits)
+        def run(*args):
+            with self.capture() as dependencies:
+                result = func(*args)
+            return result, frozenset(dependencies)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            result, dependencies = run(*args)
+            self.replay(dependencies)
+            return result
+
+        wrapper.cache_info = run.cache_info
+        wrapper.cache_clear = run.cache_clear
+        return wrapper
+
+    def _compute_signature(self, dependency):
+        if dependency.endswith('/'):
+            files = sorted(self._source.list_files(dependency[:-1]))
+            data = '\n'.join(files).encode('utf-8')
+            return hashlib.sha1(data).hexdigest()
+        if dependency.startswith('?'):
+            if self._source.get_file_signature(dependency[1:]) is None:
+                return None
+            return 'exists'
+        return self._source.get_file_signature(dependency)
+
+    def get_signature(self, dependency):
+        """Return a string that changes when the dependency changes."""
+        if self._signatures is None:
+            if dependency.endswith('/'):
+                return self._get_listing_signature(dependency)
+            return self._compute_signature(dependency)
+        try:
+            return self._signatures[dependency]
+        except KeyError:
+            signature = self._compute_signature(dependency)
+            return self._signatures.setdefault(dependency, signature)
+
+    def _get_listing_signature(self, dependency):
+        # Listings of indexed sources only change along with the version of
+        # the index, so their signatures are reused until then.
+        version = self._source.index_version
+        if version is None:
+            return self._compute_signature(dependency)
+        listings = self._listings
+        if listings[0] != version:
+            listings = self._listings = version, {}
+        try:
+            return listings[1][dependency]
+        except KeyError:
+            signature = self._compute_signature(dependency)
+            return listings[1].setdefault(dependency, signature)
+
+    def get_signatures(self, dependencies):
+        return {dep: self.get_signature(dep) for dep in dependencies}
+
+    def is_up_to_date(self, signatures):
+        """Check if dependencies didn't change since signatures were taken."""
+        return all(self.get_signature(dep) == signature
+                   for dep, signature in signatures.items())
+
+
+class SiteConfig(configparser.ConfigParser):
+    """The parsed contents of `settings.ini`.
+
+    Instances are shared between all users of a source and therefore can't
+    be modified. Values that are looked up frequently are precomputed.
+
+    Parameters
+    ----------
+    data: str
+        The contents of `settings.ini`.
+
+    """
+
+    def __init__(self, data):
+        configparser.ConfigParser.__init__(self)
+        self.read_string(data)
+
+        self._defaultlocale = self.get('general', 'defaultlocale',
+                                       fallback=None)
+        self._defaultpage = self.get('general', 'defaultpage', fallback=None)
+        if self.has_section('locale_overrides'):
+            self.locale_overrides = dict(self.items('locale_overrides'))
+        else:
+            self.locale_overrides = {}
+        self._frozen = True
+
+    @property
+    def defaultlocale(self):
+        if self._defaultlocale is None:
+            # Raise the usual error for the missing option
+            return self.get('general', 'defaultlocale')
+        return self._defaultlocale
+
+    @property
+    def defaultpage(self):
+        if self._defaultpage is None:
+            return self.get('general', 'defaultpage')
+        return self._defaultpage
+
+    def get_locale_file(self, page):
+        """Return the name of the locale file used by a page.
+
+        This is the page name unless overridden in `locale_overrides`.
+        """
+        return self.locale_overrides.get(self.optionxform(page), page)
+
+    def _check_mutable(self):
+        if getattr(self, '_frozen', False):
+            raise TypeError('The website configuration is read-only')
+
+    def read_string(self, *args, **kwargs):
+        self._check_mutable()
+        configparser.ConfigParser.read_string(self, *args, **kwargs)
+
+    def add_section(self, *args, **kwargs):
+        self._check_mutable()
+        configparser.ConfigParser.add_section(self, *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        self._check_mutable()
+        configparser.ConfigParser.set(self, *args, **kwargs)
+
+    def remove_section(self, *args, **kwargs):
+        self._check_mutable()
+        return configparser.ConfigParser.remove_section(self, *args, **kwargs)
+
+    def remove_option(self, *args, **kwargs):
+        self._check_mutable()
+        return configparser.ConfigParser.remove_option(self, *args, **kwargs)
+
+
+class PageMetadataIndex:
+    """The metadata of all pages of a website, indexed for filtering.
+
+    Each filter is looked up in precomputed postings that map the values of a
+    metadata variable (or, for list values, their elements) to the pages
+    having them, rather than comparing it with the metadata of every page.
+
+    Parameters
+    ----------
+    pages: iterable
+        `(page, metadata)` pairs in the order the pages should be returned.
+        The metadata gets a `page` variable with the page name unless it
+        already has one.
+
+    """
+
+    def __init__(self, pages):
+        self._pages = []
+        # Map variable names to the positions of the pages having them, and
+        # (for each kind of value) to the positions by value
+        self._names = collections.defaultdict(set)
+        self._elements = collections.defaultdict(
+            lambda: collections.defaultdict(set),
+        )
+        self._values = collections.defaultdict(
+            lambda: collections.defaultdict(set),
+        )
+        self._unhashable = collections.defaultdict(set)
+
+        for i, (page, metadata) in enumerate(pages):
+            metadata = dict(metadata)
+            metadata.setdefault('page', page)
+            self._pages.append(metadata)
+            for name, value in metadata.items():
+                self._names[name].add(i)
+                if isinstance(value, list):
+                    elements = self._elements[name]
+                    elements[None].add(i)
+                    for element in value:
+                        if isinstance(element, str):
+                            elements[element].add(i)
+                else:
+                    try:
+                        self._values[name][value].add(i)
+                    except TypeError:
+                        self._unhashable[name].add(i)
+
+    def __len__(self):
+        return len(self._pages)
+
+    def _match(self, name, value):
+        """Return the positions of the pages that match a single filter."""
+        result = set()
+        elements = self._elements.get(name)
+        if elements:
+            if isinstance(value, str) or \
+                    not isinstance(value, collections.abc.Iterable):
+                options = [value]
+            else:
+                options = value
+            matching = elements[None]
+            for option in options:
+                matching = matching & elements.get(str(option), set())
+            result.update(matching)
+
+        values = self._values.get(name, {})
+        try:
+            result.update(values.get(value, ()))
+        except TypeError:
+            result.update(i for positions in values.values()
+                          for i in positions
+                          if self._pages[i][name] == value)
+        result.update(i for i in self._unhashable.get(name, ())
+                      if self._pages[i][name] == value)
+        return result
+
+    def filter(self, filters=None):
+        """Return the metadata of the pages matching all filters.
+
+        Parameters
+        ----------
+        filters: dict
+            Values that the metadata variables of the pages need to have.
+            If a page has a list of values for a variable, each of the
+            filter values (either a single value or a list of them) has to
+            be in that list. No filters match all pages.
+
+        Returns
+        -------
+        list
+            Copies of the metadata of the matching pages.
+
+        """
+        if not filters:
+            return [dict(metadata) for metadata in self._pages]
+
+        positions = None
+        for name, value in filters.items():
+            matching = self._match(name, value)
+            positions = matching if positions is None else positions & matching
+            if not positions:
+                return []
+        return [dict(self._pages[i]) for i in sorted(positions)]
+
+
+class LinkTable:
+    """The files of an indexed source that links can point to.
+
+    Built from the listings of `pages/`, `locales/` and `static/`, so that
+    links are resolved without probing the source for every file that they
+    might refer to. What a link points to is only looked up once per page
+    name.
+
+    Parameters
+    ----------
+    source: Source
+        The source whose files are listed.
+    config: SiteConfig
+        The configuration of the website.
+
+    """
+
+    def __init__(self, source, config):
+        self.config = config
+        # Identifies the state of the source the table was built from
+        self.index_version = source.index_version
+        self._source = source
+        files = set()
+        for subdir in ['pages', 'locales', 'static']:
+            files.update(subdir + '/' + filename
+                         for filename in source.list_files(subdir))
+        self._files = frozenset(files)
+        # Maps page names to their targets and the files probed for them
+        self._targets = {}
+
+    def has_file(self, filename):
+        self._source._record_file(filename, contents=False)
+        return filename in self._files
+
+    def find_target(self, page):
+        """Return what a link to a page points to (see `Source.resolve_link`).
+
+        The same files are recorded as accessed as when probing the source.
+        """
+        try:
+            target, probes = self._targets[page]
+        except KeyError:
+            probes = []
+
+            def has_file(filename):
+                probes.append(filename)
+                return filename in self._files
+
+            target = self._source._find_link_target(page, self.config,
+                                                    has_file)
+            self._targets[page] = target, probes
+
+        for filename in probes:
+            self._source._record_file(filename, contents=False)
+        return target
+
 
 class Source:
+    dependencies = None
+    indexed = False
+    cached = False
+    # The signature of settings.ini and the config parsed from it
+    _config_snapshot = None
+    # The signatures of the pages and the metadata index built from them
+    _metadata_snapshot = None
+    # Identifies the state of the index of indexed sources (see `refresh`)
+    index_version = None
+    _link_table = None
+
+    def track_dependencies(self, tracker):
+        """Report file accesses of this source to a `DependencyTracker`."""
+        self.dependencies = tracker
+
+    def _record_file(self, filename, contents=True):
+        if self.dependencies is not None:
+            self.dependencies.record(filename if contents else '?' + filename)
+
+    def _record_dir(self, subdir):
+        if self.dependencies is not None:
+            self.dependencies.record(subdir.rstrip('/') + '/')
+
+    def get_file_signature(self, filename):
+        """Return a string that identifies the version of a file.
+
+        The signature changes when the file is modified, created or removed.
+        None is returned if the file doesn't exist.
+        """
+        raise NotImplementedError
+
+    def refresh(self):
+        """Pick up files created or removed since the source was indexed.
+
+        This only affects indexed sources, other sources always see the
+        current state of their files.
+        """
+        pass
+
+    def _find_link_target(self, page, config, has_file):
+        """Find out what a link to a page points to.
+
+        Returns
+        -------
+        (str, str)
+            The kind of file (`localizable`, `page`, `static` or None if there
+            is none) and the name of the localizable file or page.
+
+        """
+        if has_file(self.localizable_file_filename(config.defaultlocale,
+                                                   page)):
+            return 'localizable', page
+
+        from cms.converters import converters
+        alternative_page = '/'.join([page.rstrip('/'),
+                                     config.defaultpage]).lstrip('/')
+        for name in [page, alternative_page]:
+            if any(has_file(self.page_filename(name, format))
+                   for format in converters):
+                return 'page', name
+
+        if has_file(self.static_filename(page)):
+            return 'static', page
+        return None, page
+
+    def _get_link_table(self, config):
+        """Return the `LinkTable` of an indexed source, None otherwise."""
+        if self.index_version is None:
+            return None
+        table = self._link_table
+        if table is None or table.config is not config or \
+                table.index_version != self.index_version:
+            # Pages don't depend on the listings, only on the files their
+            # links point to (recorded by the table).
+            tracker = self.dependencies
+            with tracker.ignore() if tracker else contextlib.nullcontext():
+                table = self._link_table = LinkTable(self, config)
+        return table
+
+    def _add_unresolved_link(self, source_page, page):
+        links = self.__dict__.setdefault('_unresolved_links', {})
+        links.setdefault(page, set()).add(source_page)
+
+    def pop_unresolved_links(self):
+        """Return the links that couldn't be resolved since the last call.
+
+        Returns
+        -------
+        dict
+            The sets of pages linking to each link target.
+
+        """
+        return self.__dict__.pop('_unresolved_links', {})
+
     def resolve_link(self, url, locale, source_page=None):
         parsed = urllib.parse.urlparse(url)
         page = parsed.path
@@ -43,24 +553,28 @@ class Source:
             return None, None
 
         config = self.read_config()
-        default_locale = config.get('general', 'defaultlocale')
-        default_page = config.get('general', 'defaultpage')
-        alternative_page = '/'.join([page.rstrip('/'), default_page]).lstrip('/')
+        default_locale = config.defaultlocale
+        default_page = config.defaultpage
 
-        if self.has_localizable_file(default_locale, page):
-            if not self.has_localizable_file(locale, page):
-                locale = default_locale
-        elif self.has_page(page):
-            if not self.has_locale(locale, page):
+        table = self._get_link_table(config)
+        if table is not None:
+            has_file = table.has_file
+            kind, name = table.find_target(page)
+        else:
+            has_file = self.has_file
+            kind, name = self._find_link_target(page, config, has_file)
+
+        if kind == 'localizable':
+            if not has_file(self.localizable_file_filename(locale, page)):
                 locale = default_locale
-        elif self.has_page(alternative_page):
-            if not self.has_locale(locale, alternative_page):
+        elif kind == 'page':
+            if not self.has_locale(locale, name):
                 locale = default_locale
-        elif self.has_static(page):
+        elif kind == 'static':
             locale = None
         else:
-            logging.warning('Link from "%s" to "%s" cannot be resolved',
-                            source_page, page)
+            # Reported at once by `log_unresolved_links`
+            self._add_unresolved_link(source_page, page)
 
         parts = page.split('/')
         if parts[-1] == default_page:
@@ -71,11 +585,62 @@ class Source:
         return locale, '/' + page
 
     def read_config(self):
-        configdata = self.read_file('settings.ini')[0]
-        config = configparser.SafeConfigParser()
-        config.readfp(StringIO(configdata))
+        """Return the configuration of the website as `SiteConfig`.
+
+        The parsed configuration is reused until the signature of
+        `settings.ini` changes.
+        """
+        try:
+            signature = self.get_file_signature('settings.ini')
+        except NotImplementedError:
+            signature = None
+
+        snapshot = self._config_snapshot
+        if signature is not None and snapshot is not None and \
+                snapshot[0] == signature:
+            self._record_file('settings.ini')
+            return snapshot[1]
+
+        config = SiteConfig(self.read_file('settings.ini')[0])
+        if signature is not None:
+            self._config_snapshot = signature, config
         return config
 
+    def read_file_head(self, filename, is_complete):
+        """Read the beginning of a text file.
+
+        Parameters
+        ----------
+        filename: str
+            The name of the file, relative to the source root.
+        is_complete: callable
+            Called with the text read so far. Reading stops once it returns
+            True (or at the end of the file).
+
+        Returns
+        -------
+        str
+            The text read, possibly the whole file.
+
+        """
+        return self.read_file(filename)[0]
+
+    def open_file(self, filename):
+        """Open a file for reading binary data without loading it at once.
+
+        Parameters
+        ----------
+        filename: str
+            The name of the file, relative to the source root.
+
+        Returns
+        -------
+        file-like object
+            The file, opened in binary mode. The caller has to close it.
+
+        """
+        return io.BytesIO(self.read_file(filename, True)[0])
+
     def exec_file(self, filename):
         source, filename = self.read_file(filename)
         code = compile(source, filename, 'exec')
@@ -110,6 +675,48 @@ class Source:
     def read_page(self, page, format):
         return self.read_file(self.page_filename(page, format))
 
+    def read_page_head(self, page, format):
+        """Read as much of a page as needed to extract its metadata."""
+        return self.read_file_head(self.page_filename(page, format),
+                                   utils.is_page_head_complete)
+
+    def read_pages_metadata(self, head_only=False):
+        """Return the metadata of all pages as `PageMetadataIndex`.
+
+        The index is reused until a page is modified, created or removed.
+        If `head_only` is set, it is built by reading only the beginning of
+        each page, as far as the metadata goes.
+        """
+        pages = sorted(self.list_pages())
+        signatures = []
+        for page, format in pages:
+            filename = self.page_filename(page, format)
+            try:
+                signatures.append(self.get_file_signature(filename))
+            except NotImplementedError:
+                signatures = None
+                break
+
+        snapshot = self._metadata_snapshot
+        if signatures is not None and snapshot is not None and \
+                snapshot[0] == (head_only, pages, signatures):
+            for page, format in pages:
+                self._record_file(self.page_filename(page, format))
+            return snapshot[1]
+
+        def read_metadata(page, format):
+            if head_only:
+                data = self.read_page_head(page, format)
+            else:
+                data = self.read_page(page, format)[0]
+            return utils.extract_page_metadata(data)[0]
+
+        index = PageMetadataIndex((page, read_metadata(page, format))
+                                  for page, format in pages)
+        if signatures is not None:
+            self._metadata_snapshot = (head_only, pages, signatures), index
+        return index
+
     #
     # Localizable files helpers
     #
@@ -119,7 +726,7 @@ class Source:
         return 'locales/%s/%s' % (locale, filename)
 
     def list_localizable_files(self):
-        default_locale = self.read_config().get('general', 'defaultlocale')
+        default_locale = self.read_config().defaultlocale
         return [f for f in self.list_files('locales/%s' % default_locale) if os.path.splitext(f)[1].lower() != '.json']
 
     def has_localizable_file(self, locale, filename):
@@ -145,16 +752,23 @@ class Source:
     def read_static(self, filename):
         return self.read_file(self.static_filename(filename), True)[0]
 
+    def open_static(self, filename):
+        return self.open_file(self.static_filename(filename))
+
+    def get_static_fingerprint(self, filename):
+        """Return a short hash of the contents of a static file."""
+        digest = hashlib.sha1()
+        with self.open_static(filename) as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()[:FINGERPRINT_LENGTH]
+
     #
     # Locale helpers
     #
 
     def locale_filename(self, locale, page):
-        config = self.read_config()
-        try:
-            page = config.get('locale_overrides', page)
-        except configparser.Error:
-            pass
+        page = self.read_config().get_locale_file(page)
         return self.localizable_file_filename(locale, page + '.json')
 
     def list_locales(self):
@@ -169,7 +783,7 @@ class Source:
         return self.has_file(self.locale_filename(locale, page))
 
     def read_locale(self, locale, page):
-        default_locale = self.read_config().get('general', 'defaultlocale')
+        default_locale = self.read_config().defaultlocale
         result = collections.OrderedDict()
         if locale != default_locale:
             result.update(self.read_locale(default_locale, page))
@@ -223,8 +837,25 @@ class Source:
 
 
 class FileSource(Source):
-    def __init__(self, dir):
+    """A source reading the files of a website from a directory.
+
+    Parameters
+    ----------
+    dir: str
+        The root directory of the website.
+    indexed: bool
+        Whether to keep an in-memory index of the directory tree. Existence
+        checks and listings are then answered from the index rather than
+        issuing system calls for every file. Each directory is scanned once,
+        when first accessed, until `refresh()` is called.
+
+    """
+
+    def __init__(self, dir, indexed=False):
         self._dir = dir
+        self.indexed = indexed
+        self._index = {}
+        self.index_version = 0 if indexed else None
 
     def __enter__(self):
         return self
@@ -242,10 +873,78 @@ class FileSource(Source):
     def get_path(self, filename):
         return os.path.join(self._dir, *filename.split('/'))
 
+    def _scan_dir(self, dirname):
+        """Return the files and subdirectories of a directory from the index.
+
+        Directories are scanned when they are first accessed. Their
+        modification time is stored so that `refresh()` can tell whether
+        files were created or removed since.
+        """
+        try:
+            return self._index[dirname][1:]
+        except KeyError:
+            pass
+
+        entry = self._read_dir(dirname)
+        self._index[dirname] = entry
+        return entry[1:]
+
+    def _read_dir(self, dirname):
+        path = self.get_path(dirname)
+        files = set()
+        subdirs = []
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        files.add(entry.name)
+                    elif entry.is_dir():
+                        subdirs.append(entry.name)
+        except OSError:
+            return _MISSING_DIR, set(), []
+
+        # Changes made shortly after the modification time could have been
+        # missed on file systems with coarse timestamps, so the directory
+        # is always scanned again by the next refresh then.
+        if time.time_ns() - mtime < RACY_INTERVAL_NS:
+            mtime = None
+        return mtime, files, subdirs
+
+    def refresh(self):
+        for dirname, (mtime, files, subdirs) in list(self._index.items()):
+            try:
+                current = os.stat(self.get_path(dirname)).st_mtime_ns
+            except OSError:
+                current = _MISSING_DIR
+            if mtime is not None and current == mtime:
+                continue
+
+            # The directory is scanned again right away, so that the version
+            # of the index only changes if its entries actually did.
+            entry = self._read_dir(dirname)
+            self._index[dirname] = entry
+            if entry[1] != files or sorted(entry[2]) != sorted(subdirs):
+                self.index_version += 1
+
     def has_file(self, filename):
+        self._record_file(filename, contents=False)
+        if self.indexed:
+            dirname, _, basename = filename.rpartition('/')
+            return basename in self._scan_dir(dirname)[0]
         return os.path.isfile(self.get_path(filename))
 
+    def get_file_signature(self, filename):
+        try:
+            st = os.stat(self.get_path(filename))
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return '{}:{}'.format(st.st_mtime_ns, st.st_size)
+
     def read_file(self, filename, binary=False):
+        self._record_file(filename)
         path = self.get_path(filename)
 
         if binary:
@@ -256,9 +955,37 @@ class FileSource(Source):
         with file:
             return (file.read(), path)
 
+    def open_file(self, filename):
+        self._record_file(filename)
+        return open(self.get_path(filename), 'rb')
+
+    def read_file_head(self, filename, is_complete):
+        self._record_file(filename)
+        chunks = []
+        with io.open(self.get_path(filename), 'r', encoding='utf-8') as file:
+            while True:
+                chunk = file.read(HEAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                if is_complete(''.join(chunks)):
+                    break
+        return ''.join(chunks)
+
     def list_files(self, subdir):
+        self._record_dir(subdir)
         result = []
 
+        if self.indexed:
+            def do_list_indexed(dirname, relpath):
+                files, subdirs = self._scan_dir(dirname)
+                result.extend(relpath + filename for filename in files)
+                for name in subdirs:
+                    do_list_indexed('/'.join((dirname, name)).lstrip('/'),
+                                    relpath + name + '/')
+            do_list_indexed(subdir.rstrip('/'), '')
+            return result
+
         def do_list(dir, relpath):
             try:
                 files = os.listdir(dir)
@@ -275,7 +1002,8 @@ class FileSource(Source):
         return result
 
     def write_to_config(self, section, option, value):
-        config = self.read_config()
+        config = configparser.ConfigParser()
+        config.read_string(self.read_file('settings.ini')[0])
         try:
             config.set(section, option, value)
         except configparser.NoSectionError:
@@ -283,6 +1011,7 @@ class FileSource(Source):
             config.set(section, option, value)
         with open(self.get_path('settings.ini'), 'w') as cnf:
             config.write(cnf)
+        self._config_snapshot = None
 
     def get_cache_dir(self):
         return os.path.join(self._dir, 'cache')
@@ -293,11 +1022,20 @@ class MultiSource(Source):
 
     def __init__(self, base_sources):
         self._bases = base_sources
+        self.indexed = all(base.indexed for base in base_sources)
+        # Maps file names to the base that provides them, if indexed
+        self._owners = {}
 
     @property
     def version(self):
         return self._bases[0].version
 
+    @property
+    def index_version(self):
+        if not self.indexed:
+            return None
+        return tuple(base.index_version for base in self._bases)
+
     def get_cache_dir(self):
         return self._bases[0].get_cache_dir()
 
@@ -314,14 +1052,74 @@ class MultiSource(Source):
         for base in self._bases:
             base.close()
 
-    def has_file(self, filename):
-        return any(base.has_file(filename) for base in self._bases)
+    def track_dependencies(self, tracker):
+        Source.track_dependencies(self, tracker)
+        for base in self._bases:
+            base.track_dependencies(tracker)
+
+    def get_file_signature(self, filename):
+        for i, base in enumerate(self._bases):
+            signature = base.get_file_signature(filename)
+            if signature is not None:
+                return '{}:{}'.format(i, signature)
+        return None
+
+    def refresh(self):
+        self._owners.clear()
+        for base in self._bases:
+            base.refresh()
+
+    def _find_base(self, filename):
+        """Return the first base that has a file, None if there is none.
+
+        For indexed sources the base is looked up only once per file, files
+        in later bases being shadowed by the earlier ones.
+        """
+        if self.indexed:
+            try:
+                owner = self._owners[filename]
+            except KeyError:
+                pass
+            else:
+                self._record_file(filename, contents=False)
+                return owner
 
-    def read_file(self, filename, binary=False):
         for base in self._bases:
             if base.has_file(filename):
-                return base.read_file(filename, binary)
-        raise KeyError('File not found {}'.format(filename))
+                break
+        else:
+            base = None
+
+        if self.indexed:
+            self._owners[filename] = base
+        return base
+
+    def has_file(self, filename):
+        return self._find_base(filename) is not None
+
+    def read_file(self, filename, binary=False):
+        base = self._find_base(filename)
+        if base is None:
+            raise KeyError('File not found {}'.format(filename))
+        return base.read_file(filename, binary)
+
+    def open_file(self, filename):
+        base = self._find_base(filename)
+        if base is None:
+            raise KeyError('File not found {}'.format(filename))
+        return base.open_file(filename)
+
+    def read_file_head(self, filename, is_complete):
+        base = self._find_base(filename)
+        if base is None:
+            raise KeyError('File not found {}'.format(filename))
+        return base.read_file_head(filename, is_complete)
+
+    def get_path(self, filename):
+        base = self._find_base(filename)
+        if base is None:
+            raise KeyError('File not found {}'.format(filename))
+        return base.get_path(filename)
 
     def list_files(self, subdir):
         return {f for base in self._bases for f in base.list_files(subdir)}
@@ -359,7 +1157,28 @@ class MultiSource(Source):
             return False
 
 
-def create_source(path, cached=False):
+def log_unresolved_links(links):
+    """Log a single warning about links that couldn't be resolved.
+
+    Parameters
+    ----------
+    links: dict
+        The sets of pages linking to each link target, as returned by
+        `Source.pop_unresolved_links`.
+
+    """
+    if not links:
+        return
+    lines = ['{} link targets cannot be resolved:'.format(len(links))]
+    for page, source_pages in sorted(links.items()):
+        lines.append('  "{}" from {}'.format(page, ', '.join(
+            '"{}"'.format(source_page)
+            for source_page in sorted(source_pages, key=str)
+        )))
+    logging.warning('\n'.join(lines))
+
+
+def create_source(path, cached=False, indexed=False):
     """Create a source from path.
 
     `cached` flag activates caching. This can be used to optimize performance
@@ -367,6 +1186,10 @@ def create_source(path, cached=False):
     This is usually the case with static generation (as opposed to dynamic
     preview).
 
+    `indexed` flag makes the source keep an in-memory index of the files of
+    the website (see `FileSource`). Call `refresh()` on the source to pick up
+    files that have been created or removed since.
+
     If `settings.ini` in the source contains `[paths]` section with an
     `additional-paths` key that contains the list of additional root folders,
     `MultiSource` will be instantiated and its bases will be the original
@@ -374,8 +1197,11 @@ def create_source(path, cached=False):
     `MultiSource` looks up files in its base sources in the order they are
     provided, so the files in the additional folders will only be used if the
     original source doesn't contain that file.
+
+    The created source reports the files it accesses to a `DependencyTracker`
+    available as its `dependencies` attribute.
     """
-    source = FileSource(path)
+    source = FileSource(path, indexed)
 
     try:
         config = source.read_config()
@@ -386,23 +1212,18 @@ def create_source(path, cached=False):
 
     if additional_paths:
         additional_sources = [
-            create_source(os.path.join(path, p))
+            create_source(os.path.join(path, p), indexed=indexed)
             for p in additional_paths
         ]
         source = MultiSource([source] + additional_sources)
 
+    tracker = DependencyTracker(source, cached)
+    source.track_dependencies(tracker)
+
     if cached:
-        for fname in [
-            'list_files',
-            'list_locales',
-            'resolve_link',
-            'read_config',
-            'read_template',
-            'read_locale',
-            'read_file',
-            'read_include',
-            'exec_file',
-        ]:
-            setattr(source, fname, utils.memoize(getattr(source, fname)))
+        source.cached = True
+        for fname, limits in CACHED_METHODS.items():
+            method = tracker.memoize(getattr(source, fname), **limits)
+            setattr(source, fname, method)
 
     return source
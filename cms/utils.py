@@ -13,43 +13,212 @@
 # You should have received a copy of the GNU General Public License
 # along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import functools
 import re
 import json
+import sys
+import threading
+import weakref
 
 __all__ = [
     'get_page_params',
+    'get_page_content',
+    'get_translation_ratio',
     'process_page',
     'split_head_body',
     'extract_page_metadata',
 ]
 
 
-def memoize(func):
+CacheInfo = collections.namedtuple('CacheInfo', [
+    'hits', 'misses', 'maxsize', 'currsize', 'maxbytes', 'currbytes',
+])
+
+_MISSING = object()
+
+
+def get_size(value):
+    """Estimate the memory used by a value.
+
+    Items of tuples, lists, sets and dictionaries are included in the
+    estimate, other objects are only counted shallowly.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list, set, frozenset)):
+        size += sum(get_size(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(get_size(k) + get_size(v) for k, v in value.items())
+    return size
+
+
+class Cache:
+    """A thread-safe cache that evicts the least recently used entries.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximal number of entries, unlimited if None.
+    maxbytes : int
+        Maximal total size of the values (as estimated by `sizeof`),
+        unlimited if None. Values larger than that aren't cached at all.
+    weak : bool
+        Whether the keys are tuples with an object as first item that should
+        only be referenced weakly. The entries for an object are removed once
+        it's garbage collected.
+    sizeof : function
+        Estimates the size of a value in bytes.
+
+    """
+
+    def __init__(self, maxsize=None, maxbytes=None, weak=False,
+                 sizeof=get_size):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._weak = weak
+        self._sizeof = sizeof
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        # IDs of the objects (in weak keys) that are being watched, and of
+        # those that have been garbage collected since the last operation.
+        self._watched = set()
+        self._collected = []
+
+    def _make_key(self, key):
+        if self._weak:
+            return (id(key[0]),) + key[1:]
+        return key
+
+    def _watch(self, obj):
+        # Entries aren't removed by the finalizer itself: it can run in the
+        # middle of another operation, even in the same thread.
+        oid = id(obj)
+        if oid not in self._watched:
+            self._watched.add(oid)
+            weakref.finalize(obj, self._collected.append, oid)
+
+    def _remove_collected(self):
+        if not self._collected:
+            return
+        collected = set()
+        while self._collected:
+            collected.add(self._collected.pop())
+        self._watched -= collected
+        for key in [key for key in self._entries if key[0] in collected]:
+            self._bytes -= self._entries.pop(key)[1]
+
+    def get(self, key, default=None):
+        """Return the value cached for a key or `default` if there is none."""
+        with self._lock:
+            self._remove_collected()
+            key = self._make_key(key)
+            try:
+                value = self._entries[key][0]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def setdefault(self, key, value):
+        """Cache a value for a key unless it has one, return the cached value.
+
+        If another thread cached a value for the key in the meantime, that
+        one is kept and returned.
+        """
+        size = 0 if self.maxbytes is None else self._sizeof(value)
+        with self._lock:
+            self._remove_collected()
+            if self._weak:
+                self._watch(key[0])
+            key = self._make_key(key)
+            try:
+                return self._entries[key][0]
+            except KeyError:
+                pass
+            if self.maxbytes is not None and size > self.maxbytes:
+                return value
+
+            self._entries[key] = value, size
+            self._bytes += size
+            while (self.maxsize is not None and
+                   len(self._entries) > self.maxsize or
+                   self.maxbytes is not None and self._bytes > self.maxbytes):
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+            return value
+
+    def pop(self, key, default=None):
+        """Remove the entry for a key, return its value or `default`."""
+        with self._lock:
+            self._remove_collected()
+            try:
+                value, size = self._entries.pop(self._make_key(key))
+            except KeyError:
+                return default
+            self._bytes -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            self._remove_collected()
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._entries), self.maxbytes, self._bytes)
+
+
+def memoize(func=None, maxsize=None, maxbytes=None, weak=False):
     """Cache results of functions calls.
 
+    Can be used as `@memoize` or, to limit the cache, as
+    `@memoize(maxsize=...)`.
+
     Parameters
     ----------
     func : function
         Function to be cached.
+    maxsize : int
+        Maximal number of cached results, unlimited if None.
+    maxbytes : int
+        Maximal estimated size of the cached results, unlimited if None.
+    weak : bool
+        Whether to only keep a weak reference to the first argument (e.g.
+        `self` of methods). The results for it are dropped once it's garbage
+        collected.
 
     Returns
     -------
     wrapped : function
         Function that returns the same results as `func`, but only calls `func`
-        once for each value of arguments.
+        once for each value of arguments (as long as the result stays in the
+        cache). The `cache_info()` and `cache_clear()` functions of the
+        wrapper return the statistics of the cache and clear it.
 
     """
-    memoized = {}
+    if func is None:
+        return functools.partial(memoize, maxsize=maxsize, maxbytes=maxbytes,
+                                 weak=weak)
+
+    cache = Cache(maxsize, maxbytes, weak)
 
     @functools.wraps(func)
     def wrapper(*args):
-        try:
-            return memoized[args]
-        except KeyError:
-            return memoized.setdefault(args, func(*args))
+        result = cache.get(args, _MISSING)
+        if result is _MISSING:
+            result = cache.setdefault(args, func(*args))
+        return result
 
-    wrapper.cache_clear = memoized.clear
+    wrapper.cache_info = cache.info
+    wrapper.cache_clear = cache.clear
     return wrapper
 
 
@@ -125,9 +294,39 @@ def extract_page_metadata(source):
     return metadata, source
 
 
+def is_page_head_complete(head):
+    """Check whether the beginning of a page contains all of its metadata.
+
+    Parameters
+    ----------
+    head: str
+        The beginning of the source text of the page.
+
+    Returns
+    -------
+    bool
+        True if `extract_page_metadata` returns the same metadata for `head`
+        as for the whole source text, regardless of how it continues.
+
+    """
+    stripped = head.lstrip()
+    if stripped.startswith('<!--'):
+        return '-->' in stripped[4:]
+    if not stripped or '<!--'.startswith(stripped) or head.startswith('{'):
+        # The comment could still begin or a JSON object continue.
+        return False
+
+    # Variables are read line by line up to the first line that doesn't
+    # define one. The last line might not be complete yet.
+    return any(not re.search(r'^\s*[\w\-]+\s*=', line)
+               for line in head.splitlines(True)[:-1])
+
+
 def get_page_params(source, locale, page, format=None, site_url_override=None,
-                    localized_string_callback=None, relative=None):
-    from cms.converters import converters
+                    localized_string_callback=None, relative=None,
+                    translation_ratio_only=False, links=True,
+                    head_only=False):
+    from cms.converters import converters, process_links
 
     # Guess page format if omitted, but default to Markdown for friendlier exceptions
     if format is None:
@@ -145,10 +344,11 @@ def get_page_params(source, locale, page, format=None, site_url_override=None,
         'config': source.read_config(),
         'localized_string_callback': localized_string_callback,
         'relative': relative,
+        'translation_ratio_only': translation_ratio_only,
     }
 
     params['localedata'] = source.read_locale(params['locale'], page)
-    defaultlocale = params['config'].get('general', 'defaultlocale')
+    defaultlocale = params['config'].defaultlocale
     params['defaultlocale'] = defaultlocale
     params['default_localedata'] = source.read_locale(defaultlocale, page)
 
@@ -176,11 +376,20 @@ def get_page_params(source, locale, page, format=None, site_url_override=None,
     except KeyError:
         raise Exception('Page %s uses unknown format %s' % (page, format))
 
+    if head_only:
+        # Only convert what ends up in the head, the body is left out
+        head = split_head_body(body)[0]
+        body = '<head>{}</head>'.format(head) if head else ''
+
     converter = converter_class(body, filename, params)
     converted = converter()
+    if links and not translation_ratio_only:
+        converted = process_links(converted, params)
     params['head'], params['body'] = split_head_body(converted)
 
-    if converter.total_translations > 0:
+    if head_only:
+        del params['body']
+    elif converter.total_translations > 0:
         params['translation_ratio'] = (
             1 - float(converter.missing_translations) / converter.total_translations
         )
@@ -190,11 +399,84 @@ def get_page_params(source, locale, page, format=None, site_url_override=None,
     return params
 
 
+# Parameters of pages rendered for other pages (see `get_page_content`), along
+# with the signatures of the files they were rendered from
+page_contents = Cache(maxsize=2 ** 10, maxbytes=2 ** 26, weak=True)
+
+
+def get_page_content(source, locale, page, head_only=False):
+    """Render a page for use by another page.
+
+    The result is cached until one of the files it was rendered from
+    changes, i.e. for the whole build with cached sources.
+
+    Parameters
+    ----------
+    source: cms.sources.Source
+        The source of the website.
+    locale: str
+        The locale to render the page in.
+    page: str
+        The name of the page.
+    head_only: bool
+        Only convert the <head> sections of the page. The parameters then
+        don't include `body` and `translation_ratio`.
+
+    Returns
+    -------
+    dict
+        The parameters of the page (see `get_page_params`).
+
+    """
+    tracker = source.dependencies
+    if tracker is None:
+        return get_page_params(source, locale, page, head_only=head_only)
+
+    key = (source, locale, page, head_only)
+    cached = page_contents.get(key)
+    if cached is not None:
+        params, signatures = cached
+        if tracker.is_up_to_date(signatures):
+            tracker.replay(signatures)
+            return dict(params, source=source)
+        page_contents.pop(key)
+
+    with tracker.capture() as dependencies:
+        params = get_page_params(source, locale, page, head_only=head_only)
+    signatures = tracker.get_signatures(dependencies)
+
+    # Cached parameters mustn't keep the source alive
+    cached = {name: value for name, value in params.items()
+              if name != 'source'}
+    page_contents.setdefault(key, (cached, signatures))
+    return params
+
+
+def get_translation_ratio(source, locale, page, format=None):
+    """Calculate which part of the strings on a page is translated.
+
+    This only inserts the translations into the page, the conversion to HTML
+    (Markdown, link resolution) is skipped.
+
+    Returns
+    -------
+    float
+        The ratio of translated strings, 1 if the page has no strings.
+
+    """
+    params = get_page_params(source, locale, page, format,
+                             translation_ratio_only=True)
+    return params['translation_ratio']
+
+
 def process_page(source, locale, page, format=None, site_url_override=None,
-                 localized_string_callback=None, relative=False):
-    from cms.converters import TemplateConverter
+                 localized_string_callback=None, relative=False,
+                 get_link_version=None):
+    from cms.converters import TemplateConverter, process_links
 
+    # Links are rewritten once the whole document has been generated
     params = get_page_params(source, locale, page, format, site_url_override,
-                             localized_string_callback)
+                             localized_string_callback, links=False)
     params['relative'] = relative
-    return TemplateConverter(*params['templatedata'], params=params)()
+    result = TemplateConverter(*params['templatedata'], params=params)()
+    return process_links(result, params, get_link_version)
@@ -4,6 +4,8 @@ import os
 import pytest
 import shutil
 
+from cms.bin.test_server import DynamicServerHandler
+
 pytest_plugins = [
     'tests.xtm_conftest',
 ]
@@ -34,3 +36,23 @@ def temp_site_with_conflicts(tmpdir_factory):
         f.write('Page with conflicts')
 
     yield site_dir
+
+
+@pytest.fixture
+def server_site(tmpdir):
+    """Create a minimal website for tests of the test server.
+
+    Test modules add the files they need by overriding this fixture.
+    """
+    tmpdir.join('settings.ini').write(
+        '[general]\ndefaultlocale = en\ndefaultpage = index\n',
+    )
+    tmpdir.mkdir('templates').join('default.tmpl').write('{{ body|safe }}')
+    tmpdir.mkdir('pages')
+    tmpdir.mkdir('static')
+    return tmpdir
+
+
+@pytest.fixture
+def handler(server_site):
+    return DynamicServerHandler('localhost', 5000, server_site.strpath)
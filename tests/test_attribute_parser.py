@@ -0,0 +1,48 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import mock
+import pytest
+
+from cms.converters import AttributeParser, Converter
+
+
+@pytest.fixture
+def parser():
+    return AttributeParser(Converter.whitelist)
+
+
+@pytest.mark.parametrize('text', ['', 'Plain text', 'a > b; "quoted"\n'])
+def test_plain_text(parser, text):
+    with mock.patch.object(parser, 'feed') as feed:
+        assert parser.parse(text, 'page') == (text, {}, [])
+    feed.assert_not_called()
+    assert parser._parse(text, 'page') == (text, {}, [])
+
+
+def test_markup(parser):
+    text = '<a href="foo">Foo</a> &amp; <fix>Bar</fix>'
+    expected = ('<a>Foo</a> & {1}', {'a': [[('href', 'foo')]]}, ['Bar'])
+    assert parser.parse(text, 'page') == expected
+
+    with mock.patch.object(parser, 'feed') as feed:
+        assert parser.parse(text, 'page') == expected
+    feed.assert_not_called()
+
+
+def test_errors_are_not_cached(parser):
+    for pagename in ['foo', 'bar']:
+        with pytest.raises(Exception, match='on page ' + pagename):
+            parser.parse('<div>Foo</div>', pagename)
@@ -0,0 +1,122 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+
+import mock
+import pytest
+
+from cms.bin.test_server import accepts_gzip
+
+from .utils import request
+
+STYLE = b'body {}\n' * 100
+PRECOMPRESSED = gzip.compress(b'var x;', mtime=0)
+
+
+@pytest.fixture
+def server_site(server_site):
+    server_site.join('pages', 'index.md').write('Hello')
+    static = server_site.join('static')
+    static.join('style.css').write(STYLE, 'wb')
+    static.join('script.js').write(b'var x; // uncompressed', 'wb')
+    static.join('script.js.gz').write(PRECOMPRESSED, 'wb')
+    static.join('image.png').write(b'PNG', 'wb')
+    return server_site
+
+
+@pytest.mark.parametrize('header,expected', [
+    ('gzip', True),
+    ('gzip, deflate, br', True),
+    ('deflate;q=1.0, GZIP;q=0.5', True),
+    ('x-gzip', True),
+    ('*', True),
+    ('gzip;q=0', False),
+    ('gzip;q=0, *', False),
+    ('*;q=0', False),
+    ('deflate, br', False),
+    ('identity', False),
+    ('', False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) == expected
+
+
+def test_page(handler):
+    status, headers, data = request(handler, '/en/index')
+    assert 'Content-Encoding' not in headers
+    assert headers['Vary'] == 'Accept-Encoding'
+
+    with mock.patch('gzip.compress', side_effect=gzip.compress) as compress:
+        for i in range(2):
+            status, gzip_headers, gzip_data = request(
+                handler, '/en/index', accept_encoding='gzip',
+            )
+            assert status == '200 OK'
+            assert gzip.decompress(gzip_data) == data
+    assert compress.call_count == 1
+    assert gzip_headers['Content-Encoding'] == 'gzip'
+    assert gzip_headers['Content-Type'] == headers['Content-Type']
+    assert gzip_headers['ETag'] == headers['ETag'][:-1] + '-gzip"'
+
+    # Each ETag only validates the encoding it was sent with
+    assert request(handler, '/en/index', accept_encoding='gzip',
+                   if_none_match=gzip_headers['ETag'])[0] == \
+        '304 Not Modified'
+    assert request(handler, '/en/index', accept_encoding='gzip',
+                   if_none_match=headers['ETag'])[0] == '200 OK'
+    assert request(handler, '/en/index',
+                   if_none_match=gzip_headers['ETag'])[0] == '200 OK'
+
+
+def test_static_file(handler):
+    status, headers, data = request(handler, '/style.css',
+                                    accept_encoding='gzip',
+                                    range='bytes=0-3')
+    # Ranges aren't supported for files compressed on the fly
+    assert status == '200 OK'
+    assert gzip.decompress(data) == STYLE
+    assert len(data) < len(STYLE)
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert 'Content-Length' not in headers
+    assert 'Accept-Ranges' not in headers
+
+
+def test_precompressed_static_file(handler):
+    status, headers, data = request(handler, '/script.js',
+                                    accept_encoding='gzip')
+    assert data == PRECOMPRESSED
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Content-Type'] == 'text/javascript'
+    assert headers['Content-Length'] == str(len(PRECOMPRESSED))
+
+    status, headers, data = request(handler, '/script.js',
+                                    accept_encoding='gzip',
+                                    range='bytes=0-1')
+    assert (status, data) == ('206 Partial Content', PRECOMPRESSED[:2])
+
+    status, headers, data = request(handler, '/script.js')
+    assert data == b'var x; // uncompressed'
+    assert 'Content-Encoding' not in headers
+    assert headers['Vary'] == 'Accept-Encoding'
+
+
+def test_incompressible_static_file(handler):
+    status, headers, data = request(handler, '/image.png',
+                                    accept_encoding='gzip')
+    assert data == b'PNG'
+    assert 'Content-Encoding' not in headers
+    assert 'Vary' not in headers
@@ -0,0 +1,87 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+import mock
+import pytest
+
+from cms.bin.test_server import ConflictIndex
+
+from .utils import request
+
+
+def has_conflicts(pages, page):
+    # How conflicts were found by scanning all names before
+    if pages.count(page) > 1:
+        return True
+    return any(p.startswith(page + '/') or page.startswith(p + '/')
+               for p in pages)
+
+
+@pytest.fixture
+def server_site(server_site):
+    server_site.join('pages', 'foo.md').write('foo')
+    return server_site
+
+
+def test_random_names():
+    rng = random.Random(0)
+    parts = ['a', 'b', 'ab', '']
+    for i in range(300):
+        names = ['/'.join(rng.choice(parts) for j in range(rng.randint(1, 3)))
+                 for k in range(rng.randint(0, 6))]
+        index = ConflictIndex(names)
+        for j in range(10):
+            page = '/'.join(rng.choice(parts)
+                            for k in range(rng.randint(1, 3)))
+            assert index.has_conflicts(page) == has_conflicts(names, page), \
+                (names, page)
+
+
+def test_index_is_reused(server_site, handler):
+    assert not handler._has_conflicts('foo')
+
+    with mock.patch.object(handler.source, 'list_pages') as list_pages:
+        assert not handler._has_conflicts('foo')
+    list_pages.assert_not_called()
+
+    server_site.join('pages', 'foo.html').write('foo')
+    handler.source.refresh()
+    assert handler._has_conflicts('foo')
+
+
+def test_index_is_built_once(server_site, handler):
+    server_site.join('locales', 'de', 'foo.json').write('{}', ensure=True)
+    server_site.join('static', 'style.css').write('body {}')
+    with mock.patch('cms.bin.test_server.ConflictIndex',
+                    side_effect=ConflictIndex) as conflict_index:
+        for path in ['/en/foo', '/de/foo', '/style.css', '/en/missing',
+                     '/en/foo', '/de/foo']:
+            request(handler, path)
+    assert conflict_index.call_count == 1
+
+
+def test_conflict_dependencies(server_site, handler):
+    tracker = handler.source.dependencies
+    with tracker.capture() as dependencies:
+        handler._has_conflicts('foo')
+    assert {'pages/', 'locales/en/'} <= dependencies
+    signatures = tracker.get_signatures(dependencies)
+
+    server_site.join('pages', 'foo', 'bar.md').write('bar', ensure=True)
+    assert tracker.is_up_to_date(signatures)
+    handler.source.refresh()
+    assert not tracker.is_up_to_date(signatures)
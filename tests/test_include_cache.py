@@ -0,0 +1,169 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+import mock
+import pytest
+
+from cms.bin.generate_static_pages import generate_pages
+from cms.converters import Converter
+from cms.sources import create_source
+from cms.utils import get_translation_ratio, process_page
+
+PAGES = ['first', 'second', 'third']
+
+INCLUDES = {
+    'header.md': 'header_title = Header\n\n# {{heading Welcome}}',
+    'nav.tmpl': '<nav>{{ page }}</nav>',
+    'footer.tmpl': '{% set footer_seen = "yes" %}'
+                   '<footer>{{ get_string("copyright", "common") }}</footer>',
+    'nested.html': '<div><? include header ?></div>',
+    'importing.tmpl': '{% import "templates/macros" as m with context %}'
+                      '{{ m.current() }}',
+}
+
+
+@pytest.fixture
+def site_dir(tmpdir):
+    tmpdir.join('settings.ini').write(
+        '[general]\ndefaultlocale = en\ndefaultpage = first\n',
+    )
+    templates = tmpdir.mkdir('templates')
+    templates.join('default.tmpl').write(
+        '{{ header_title }} {{ footer_seen }}|{{ body|safe }}',
+    )
+    templates.join('macros.tmpl').write(
+        '{% macro current() %}{{ page }}{% endmacro %}',
+    )
+    includes = tmpdir.mkdir('includes')
+    for filename, data in INCLUDES.items():
+        includes.join(filename).write(data)
+
+    pages = tmpdir.mkdir('pages')
+    for page in PAGES:
+        pages.join(page + '.html').write(''.join(
+            '<? include {} ?>\n'.format(name.split('.')[0])
+            for name in INCLUDES
+        ))
+
+    def write_locale(locale, page, strings):
+        tmpdir.join('locales', locale, page + '.json').write(json.dumps(
+            {name: {'message': message} for name, message in strings.items()},
+        ), ensure=True)
+
+    # The first two pages share the translation of the header
+    write_locale('de', 'first', {'heading': 'Willkommen'})
+    write_locale('de', 'second', {'heading': 'Willkommen'})
+    write_locale('de', 'common', {'copyright': 'Urheberrecht'})
+    write_locale('en', 'common', {'copyright': 'Copyright'})
+    return tmpdir
+
+
+@pytest.fixture
+def conversions():
+    converted = []
+    orig_convert_include = Converter._convert_include
+
+    def convert_include(self, name, *args, **kwargs):
+        converted.append((self._params['locale'], self._params['page'], name))
+        return orig_convert_include(self, name, *args, **kwargs)
+
+    with mock.patch.object(Converter, '_convert_include', convert_include):
+        yield converted
+
+
+def render_all(source):
+    return {(locale, page): (process_page(source, locale, page),
+                             get_translation_ratio(source, locale, page))
+            for locale in ['de', 'en'] for page in PAGES}
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_same_output(site_dir, cached):
+    uncached = create_source(site_dir.strpath)
+    uncached.track_dependencies(None)
+    expected = render_all(uncached)
+    assert expected['de', 'second'][0] == (
+        'Header yes|<h1>Willkommen</h1>\n<nav>second</nav>\n'
+        '<footer>Urheberrecht</footer>\n<div><h1>Willkommen</h1></div>\n'
+        'second\n'
+    )
+    assert expected['de', 'third'][1] == pytest.approx(1 / 3)
+
+    source = create_source(site_dir.strpath, cached=cached)
+    assert render_all(source) == expected
+    # Now with all includes cached
+    assert render_all(source) == expected
+
+
+def test_includes_are_reused(site_dir, conversions):
+    source = create_source(site_dir.strpath)
+    for page in PAGES:
+        process_page(source, 'de', page)
+
+    converted = {}
+    for locale, page, name in conversions:
+        converted.setdefault(name, []).append(page)
+    # Reused for pages with the same translations
+    assert converted['header'] == ['first', 'third']
+    assert converted['footer'] == ['first']
+    # Depends on the page, or could read anything
+    assert converted['nav'] == PAGES
+    assert converted['importing'] == PAGES
+    # Includes the header, so it could only be reused with its translation
+    assert converted['nested'] == ['first', 'third']
+
+
+def test_changed_include(site_dir, conversions):
+    source = create_source(site_dir.strpath)
+    process_page(source, 'en', 'first')
+
+    site_dir.join('includes', 'footer.tmpl').write('<footer>Changed</footer>')
+    assert '<footer>Changed</footer>' in process_page(source, 'en', 'second')
+
+
+def test_callback_disables_cache(site_dir, conversions):
+    source = create_source(site_dir.strpath)
+    callback = mock.Mock()
+    for page in PAGES:
+        process_page(source, 'de', page, localized_string_callback=callback)
+    assert len(conversions) == len(PAGES) * (len(INCLUDES) + 1)
+    assert callback.call_count == len(PAGES) * 3
+
+
+def test_blacklisted_link_target(tmpdir):
+    tmpdir.join('settings.ini').write(
+        '[general]\ndefaultlocale = en\ndefaultpage = index\n',
+    )
+    tmpdir.mkdir('templates').join('default.tmpl').write('{{ body|safe }}')
+    tmpdir.mkdir('includes').join('nav.tmpl').write(
+        '{{ "other"|linkify }}Other</a>',
+    )
+    pages = tmpdir.mkdir('pages')
+    pages.join('index.tmpl').write('{{ get_page_content("child").body }}')
+    pages.join('child.html').write('<? include nav ?>')
+    pages.join('other.md').write('{{a A}} {{b B}} {{c C}} {{d D}}')
+    # Not translated enough for the page to be generated
+    tmpdir.join('locales', 'de', 'other.json').write(
+        '{"a": {"message": "A"}}', ensure=True,
+    )
+    out_dir = tmpdir.mkdir('out')
+    generate_pages(tmpdir.strpath, out_dir.strpath)
+
+    # The include is converted while calculating the translation ratio of
+    # the index page, but must link to pages that are generated.
+    assert not out_dir.join('de', 'other').exists()
+    assert 'href="/en/other"' in out_dir.join('de', 'child').read()
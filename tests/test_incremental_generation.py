@@ -0,0 +1,146 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import shutil
+
+import mock
+import pytest
+
+from cms.bin import generate_static_pages
+from cms.bin.generate_static_pages import generate_pages
+
+from .conftest import ROOTPATH
+
+
+@pytest.fixture
+def site_dir(tmpdir):
+    site_dir = tmpdir.join('test_site').strpath
+    shutil.copytree(os.path.join(ROOTPATH, 'tests', 'test_site'), site_dir)
+    yield site_dir
+
+
+@pytest.fixture
+def rendered_pages():
+    """Record the (locale, page) pairs rendered by `generate_pages`."""
+    rendered = []
+    orig_process_page = generate_static_pages.process_page
+
+    def process_page(source, locale, page, *args, **kwargs):
+        rendered.append((locale, page))
+        return orig_process_page(source, locale, page, *args, **kwargs)
+
+    with mock.patch('cms.bin.generate_static_pages.process_page',
+                    process_page):
+        yield rendered
+
+
+def test_unchanged_site_is_not_rendered(site_dir, tmpdir, rendered_pages):
+    out_dir = tmpdir.mkdir('out').strpath
+    generate_pages(site_dir, out_dir, incremental=True)
+    assert ('en', 'translate') in rendered_pages
+
+    del rendered_pages[:]
+    generate_pages(site_dir, out_dir, incremental=True)
+    assert rendered_pages == []
+    assert os.path.isfile(os.path.join(out_dir, 'de', 'translate'))
+
+
+def test_changed_locale_file(site_dir, tmpdir, rendered_pages):
+    out_dir = tmpdir.mkdir('out').strpath
+    generate_pages(site_dir, out_dir, incremental=True)
+
+    locale_file = os.path.join(site_dir, 'locales', 'de', 'translate.json')
+    with open(locale_file) as f:
+        data = f.read()
+    with open(locale_file, 'w') as f:
+        f.write(data.replace('Übersetzen', 'Geändert'))
+
+    del rendered_pages[:]
+    generate_pages(site_dir, out_dir, incremental=True)
+    assert ('de', 'translate') in rendered_pages
+    assert ('en', 'translate') not in rendered_pages
+    assert ('de', 'sitemap') not in rendered_pages
+    with open(os.path.join(out_dir, 'de', 'translate')) as f:
+        assert 'Geändert' in f.read()
+
+
+def test_removed_page(site_dir, tmpdir, rendered_pages):
+    out_dir = tmpdir.mkdir('out').strpath
+    generate_pages(site_dir, out_dir, incremental=True)
+    assert os.path.isfile(os.path.join(out_dir, 'en', 'siteurl'))
+
+    os.remove(os.path.join(site_dir, 'pages', 'siteurl.tmpl'))
+    del rendered_pages[:]
+    generate_pages(site_dir, out_dir, incremental=True)
+    assert not os.path.exists(os.path.join(out_dir, 'en', 'siteurl'))
+    assert ('en', 'translate') not in rendered_pages
+
+
+def test_different_options(site_dir, tmpdir, rendered_pages):
+    out_dir = tmpdir.mkdir('out').strpath
+    generate_pages(site_dir, out_dir, incremental=True)
+
+    del rendered_pages[:]
+    generate_pages(site_dir, out_dir, relative=True, incremental=True)
+    assert ('en', 'translate') in rendered_pages
+
+
+def test_changed_static_file(site_dir, tmpdir, rendered_pages):
+    out_dir = tmpdir.mkdir('out').strpath
+    generate_pages(site_dir, out_dir, incremental=True)
+
+    def get_icon_link():
+        with open(os.path.join(out_dir, 'en', 'rel_path')) as f:
+            return re.search(r'src="[^"]*img/icon\?(\w+)"', f.read()).group(1)
+
+    link = get_icon_link()
+    with open(os.path.join(site_dir, 'static', 'img', 'icon'), 'w') as f:
+        f.write('new icon')
+
+    del rendered_pages[:]
+    generate_pages(site_dir, out_dir, incremental=True)
+    assert ('en', 'rel_path') in rendered_pages
+    assert ('en', 'translate') not in rendered_pages
+    assert get_icon_link() != link
+
+
+def read_tree(path):
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            with open(filepath, 'rb') as f:
+                files[os.path.relpath(filepath, path)] = f.read()
+    return files
+
+
+def test_changed_filter(site_dir, tmpdir, rendered_pages):
+    out_dir = tmpdir.mkdir('out').strpath
+    generate_pages(site_dir, out_dir, incremental=True)
+
+    with open(os.path.join(site_dir, 'filters', 'foo_converter.py'), 'w') as f:
+        f.write("def foo_converter(string):\n    return 'Xfoo'\n")
+
+    del rendered_pages[:]
+    generate_pages(site_dir, out_dir, incremental=True)
+    assert ('en', 'filter') in rendered_pages
+    with open(os.path.join(out_dir, 'en', 'filter')) as f:
+        assert f.read().strip() == 'Xfoo'
+
+    full_dir = tmpdir.mkdir('full').strpath
+    generate_pages(site_dir, full_dir, fingerprint=True)
+    assert read_tree(out_dir) == read_tree(full_dir)
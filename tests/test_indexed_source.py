@@ -0,0 +1,118 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import mock
+import pytest
+
+from cms.sources import FileSource, MultiSource
+
+from .conftest import ROOTPATH
+
+SITE_PATH = os.path.join(ROOTPATH, 'tests', 'test_site')
+
+
+@pytest.fixture
+def site_dir(tmpdir):
+    site_dir = tmpdir.mkdir('site')
+    site_dir.join('settings.ini').write('')
+    site_dir.mkdir('pages').join('foo.md').write('foo')
+    return site_dir
+
+
+@pytest.mark.parametrize('subdir', ['', 'pages', 'locales', 'missing'])
+def test_list_files(subdir):
+    source = FileSource(SITE_PATH)
+    indexed = FileSource(SITE_PATH, indexed=True)
+    assert (sorted(indexed.list_files(subdir)) ==
+            sorted(source.list_files(subdir)))
+
+
+@pytest.mark.parametrize('filename', [
+    'settings.ini',
+    'pages/foo/bar.html',
+    'pages/foo',
+    'pages/missing.md',
+    'static/img/icon',
+    'static/img/icon/missing',
+    'missing/file',
+])
+def test_has_file(filename):
+    source = FileSource(SITE_PATH)
+    indexed = FileSource(SITE_PATH, indexed=True)
+    assert indexed.has_file(filename) == source.has_file(filename)
+
+
+def test_lookups_are_indexed(site_dir):
+    source = FileSource(site_dir.strpath, indexed=True)
+    assert source.has_file('pages/foo.md')
+
+    with mock.patch('os.path.isfile') as isfile, \
+            mock.patch('os.scandir') as scandir:
+        assert source.has_file('pages/foo.md')
+        assert not source.has_file('pages/bar.md')
+        assert source.list_files('pages') == ['foo.md']
+    isfile.assert_not_called()
+    scandir.assert_not_called()
+
+
+def test_refresh(site_dir):
+    source = FileSource(site_dir.strpath, indexed=True)
+    assert not source.has_file('pages/bar.md')
+
+    site_dir.join('pages', 'bar.md').write('bar')
+    site_dir.join('pages', 'foo.md').remove()
+    source.refresh()
+    assert source.has_file('pages/bar.md')
+    assert not source.has_file('pages/foo.md')
+    assert source.list_files('pages') == ['bar.md']
+
+
+def test_index_version(site_dir):
+    source = FileSource(site_dir.strpath, indexed=True)
+    assert not source.has_file('missing/foo.md')
+    assert source.has_file('pages/foo.md')
+
+    # Directories that were just modified are scanned again, and missing
+    # ones are checked, but the index only changes if their entries do.
+    source.refresh()
+    source.refresh()
+    assert source.index_version == 0
+
+    site_dir.join('missing', 'foo.md').write('foo', ensure=True)
+    source.refresh()
+    assert source.index_version == 1
+    assert source.has_file('missing/foo.md')
+
+    site_dir.join('pages', 'foo.md').write('changed')
+    source.refresh()
+    assert source.index_version == 1
+
+
+def test_multi_source_shadowing(site_dir, tmpdir):
+    other_dir = tmpdir.mkdir('other')
+    other_dir.mkdir('pages').join('foo.md').write('other foo')
+    other_dir.join('pages', 'bar.md').write('other bar')
+
+    source = MultiSource([FileSource(site_dir.strpath, indexed=True),
+                          FileSource(other_dir.strpath, indexed=True)])
+    assert source.indexed
+    assert source.read_file('pages/foo.md')[0] == 'foo'
+    assert source.read_file('pages/bar.md')[0] == 'other bar'
+
+    site_dir.join('pages', 'bar.md').write('bar')
+    source.refresh()
+    assert source.read_file('pages/bar.md')[0] == 'bar'
@@ -0,0 +1,89 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+
+import mock
+import pytest
+
+from cms.sources import create_source, log_unresolved_links
+
+from .conftest import ROOTPATH
+
+SITE_PATH = os.path.join(ROOTPATH, 'tests', 'test_site')
+
+URLS = [
+    'translate', 'translate?a=b#c', 'foo/bar', 'foo/', 'foo', 'filter',
+    'global.json', 'img/icon', 'img', 'missing', 'missing/filter',
+    'translate.json', 'sitemap', 'foo/bar#top', '', '#top', '/translate',
+    './translate', 'https://example.com/', 'tel:123',
+]
+
+
+@pytest.fixture
+def site_dir(tmpdir):
+    tmpdir.join('settings.ini').write(
+        '[general]\ndefaultlocale = en\ndefaultpage = index\n',
+    )
+    tmpdir.mkdir('pages').join('index.md').write('index')
+    return tmpdir
+
+
+@pytest.mark.parametrize('url', URLS)
+@pytest.mark.parametrize('locale', ['en', 'de', 'fr'])
+def test_same_as_probing(url, locale):
+    probing = create_source(SITE_PATH)
+    indexed = create_source(SITE_PATH, indexed=True)
+
+    results = []
+    for source in [probing, indexed]:
+        with source.dependencies.capture() as dependencies:
+            result = source.resolve_link(url, locale, 'page')
+        results.append((result, dependencies, source.pop_unresolved_links()))
+    assert results[0] == results[1]
+
+
+def test_table_is_reused(site_dir):
+    source = create_source(site_dir.strpath, indexed=True)
+    assert source.resolve_link('index', 'en') == ('en', '/en/')
+
+    with mock.patch.object(source, 'list_files') as list_files:
+        assert source.resolve_link('index', 'de') == ('en', '/en/')
+        assert source.resolve_link('foo', 'en') == ('en', '/en/foo')
+    list_files.assert_not_called()
+
+
+def test_refresh(site_dir):
+    source = create_source(site_dir.strpath, indexed=True)
+    source.resolve_link('foo', 'de', 'index')
+    assert source.pop_unresolved_links() == {'foo': {'index'}}
+
+    site_dir.join('pages', 'foo.md').write('foo')
+    site_dir.join('locales', 'de', 'foo.json').write('{}', ensure=True)
+    source.refresh()
+    assert source.resolve_link('foo', 'de', 'index') == ('de', '/de/foo')
+    assert source.pop_unresolved_links() == {}
+
+
+def test_unresolved_links_report(caplog):
+    caplog.set_level(logging.WARNING)
+    log_unresolved_links({})
+    log_unresolved_links({'foo': {'b', 'a'}, 'bar': {None}})
+    assert [t[2] for t in caplog.record_tuples] == [
+        '2 link targets cannot be resolved:\n'
+        '  "bar" from "None"\n'
+        '  "foo" from "a", "b"',
+    ]
@@ -0,0 +1,39 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+from cms.converters import get_markdown, markdown_string_to_html
+
+
+def test_instances_are_reused():
+    with get_markdown() as md:
+        with get_markdown() as nested_md:
+            assert nested_md is not md
+    with get_markdown() as reused_md:
+        assert reused_md is md
+
+
+def test_instances_are_reset():
+    with get_markdown() as md:
+        md.convert('[foo]: http://example.com/')
+    with get_markdown() as md:
+        assert 'href' not in md.convert('[bar][foo]')
+
+
+def test_string_conversion_is_memoized():
+    markdown_string_to_html.cache_clear()
+    assert markdown_string_to_html('*foo*') == '<em>foo</em>'
+    assert markdown_string_to_html('*foo*') == '<em>foo</em>'
+    info = markdown_string_to_html.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
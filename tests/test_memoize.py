@@ -0,0 +1,107 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import gc
+import threading
+
+from cms.utils import memoize
+
+
+class Counter:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, *args):
+        self.calls.append(args)
+        return args
+
+
+def test_unbounded():
+    func = memoize(Counter())
+    assert func(1) == (1,)
+    assert func(1) == (1,)
+    assert func(2) == (2,)
+    assert func.__wrapped__.calls == [(1,), (2,)]
+
+    info = func.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 2, 2)
+
+    func.cache_clear()
+    func(1)
+    assert func.__wrapped__.calls == [(1,), (2,), (1,)]
+
+
+def test_lru_eviction():
+    func = memoize(Counter(), maxsize=2)
+    func(1)
+    func(2)
+    func(1)
+    func(3)  # Evicts 2, which is the least recently used one.
+    del func.__wrapped__.calls[:]
+
+    func(1)
+    func(3)
+    func(2)
+    assert func.__wrapped__.calls == [(2,)]
+    assert func.cache_info().currsize == 2
+
+
+def test_maxbytes():
+    func = memoize(lambda n: 'x' * n, maxbytes=1000)
+    func(400)
+    func(401)
+    assert func.cache_info().currsize == 2
+    func(300)
+    assert func.cache_info().currsize == 2
+    assert func.cache_info().currbytes <= 1000
+
+    # Values larger than the cache aren't cached at all.
+    func(2000)
+    assert func.cache_info().currsize == 2
+
+
+def test_weak_keys():
+    class Owner:
+        @memoize(weak=True)
+        def get(self, arg):
+            return [arg]
+
+    owner = Owner()
+    assert owner.get(1) is owner.get(1)
+    assert Owner.get.cache_info().currsize == 1
+
+    del owner
+    gc.collect()
+    assert Owner.get.cache_info().currsize == 0
+
+
+def test_concurrent_calls():
+    func = memoize(lambda n: [n], maxsize=50)
+    results = []
+
+    def run():
+        results.append([func(i % 100) for i in range(1000)])
+
+    threads = [threading.Thread(target=run) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(result == [[i % 100] for i in range(1000)]
+               for result in results)
+    info = func.cache_info()
+    assert info.hits + info.misses == 8000
+    assert info.currsize == 50
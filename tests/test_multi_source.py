@@ -104,6 +104,13 @@ def test_read_binary(multi_source):
     assert isinstance(multi_source.read_file('a', True)[0], type(b'b'))
 
 
+def test_open_file(multi_source):
+    with multi_source.open_file('b') as file:
+        assert file.read() == b'b'
+    with pytest.raises(KeyError):
+        multi_source.open_file('d')
+
+
 def test_list_files(multi_source):
     assert sorted(multi_source.list_files('')) == ['a', 'a/b/c', 'a/d', 'b',
                                                    'c']
@@ -0,0 +1,88 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+
+import pytest
+
+from cms.bin.generate_static_pages import generate_pages
+
+from .conftest import ROOTPATH
+
+
+@pytest.fixture
+def site_dir(tmpdir):
+    site_dir = tmpdir.join('test_site').strpath
+    shutil.copytree(os.path.join(ROOTPATH, 'tests', 'test_site'), site_dir)
+    yield site_dir
+
+
+@pytest.fixture
+def out_dir(site_dir, tmpdir):
+    out_dir = tmpdir.mkdir('out').strpath
+    generate_pages(site_dir, out_dir)
+    yield out_dir
+
+
+def test_unchanged_files_are_kept(site_dir, out_dir):
+    path = os.path.join(out_dir, 'en', 'translate')
+    mtime = os.stat(path).st_mtime_ns
+
+    generate_pages(site_dir, out_dir)
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_modified_output_is_rewritten(site_dir, out_dir):
+    path = os.path.join(out_dir, 'en', 'translate')
+    with open(path) as f:
+        expected = f.read()
+    with open(path, 'w') as f:
+        f.write('modified')
+
+    generate_pages(site_dir, out_dir)
+    with open(path) as f:
+        assert f.read() == expected
+
+
+def test_removed_page_output_is_deleted(site_dir, out_dir):
+    os.remove(os.path.join(site_dir, 'pages', 'foo', 'bar.html'))
+
+    generate_pages(site_dir, out_dir)
+    assert not os.path.exists(os.path.join(out_dir, 'en', 'foo'))
+    assert os.path.isfile(os.path.join(out_dir, 'en', 'translate'))
+
+
+def test_static_files_are_copied(site_dir, out_dir):
+    src = os.path.join(site_dir, 'static', 'img', 'icon')
+    dst = os.path.join(out_dir, 'img', 'icon')
+    assert os.path.isfile(dst)
+    assert not os.path.samefile(src, dst)
+
+    with open(src, 'w') as f:
+        f.write('new icon')
+    generate_pages(site_dir, out_dir)
+    with open(dst) as f:
+        assert f.read() == 'new icon'
+
+
+def test_static_files_are_hardlinked(site_dir, tmpdir):
+    out_dir = tmpdir.mkdir('out_hardlink').strpath
+    generate_pages(site_dir, out_dir, hardlink=True)
+
+    src = os.path.join(site_dir, 'static', 'img', 'icon')
+    assert os.path.samefile(src, os.path.join(out_dir, 'img', 'icon'))
+    # Pages are written to new files, never into the linked ones.
+    assert os.stat(src).st_nlink == 2
@@ -0,0 +1,125 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import mock
+import pytest
+
+from cms import utils
+from cms.bin.generate_static_pages import generate_pages
+from cms.sources import create_source
+from cms.utils import get_page_content, process_page
+
+CHILD = '''title = Child
+
+<head>
+  <title>{{title Child title}}</title>
+</head>
+
+# {{heading Child heading}}
+
+[Link](index)
+'''
+
+
+@pytest.fixture
+def site_dir(tmpdir):
+    tmpdir.join('settings.ini').write(
+        '[general]\ndefaultlocale = en\ndefaultpage = index\n',
+    )
+    tmpdir.mkdir('templates').join('default.tmpl').write('{{ body|safe }}')
+    pages = tmpdir.mkdir('pages')
+    pages.join('index.tmpl').write(
+        '{% set child = get_page_content("child") %}'
+        '{{ child.title }}|{{ child.head|safe }}|{{ child.body|safe }}',
+    )
+    pages.join('child.md').write(CHILD)
+    tmpdir.join('locales', 'de', 'child.json').write(
+        '{"heading": {"message": "Kind"}}', ensure=True,
+    )
+    return tmpdir
+
+
+@pytest.fixture
+def rendered_pages():
+    rendered = []
+    orig_get_page_params = utils.get_page_params
+
+    def get_page_params(source, locale, page, *args, **kwargs):
+        rendered.append((locale, page))
+        return orig_get_page_params(source, locale, page, *args, **kwargs)
+
+    with mock.patch('cms.utils.get_page_params', get_page_params):
+        yield rendered
+
+
+def test_page_content(site_dir):
+    source = create_source(site_dir.strpath)
+    result = process_page(source, 'de', 'index')
+    assert result.startswith('Child|\n  <title>Child title</title>\n|')
+    assert '<h1>Kind</h1>' in result
+    assert '<a href="/en/" hreflang="en">Link</a>' in result
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_content_is_cached(site_dir, rendered_pages, cached):
+    source = create_source(site_dir.strpath, cached=cached)
+    content = get_page_content(source, 'de', 'child')
+    assert get_page_content(source, 'de', 'child') == content
+    assert get_page_content(source, 'en', 'child') != content
+    assert rendered_pages == [('de', 'child'), ('en', 'child')]
+
+    with source.dependencies.capture() as dependencies:
+        get_page_content(source, 'de', 'child')
+    assert {'pages/child.md', 'locales/de/child.json'} <= dependencies
+
+
+def test_changed_dependency(site_dir, rendered_pages):
+    source = create_source(site_dir.strpath)
+    get_page_content(source, 'de', 'child')
+
+    site_dir.join('locales', 'de', 'child.json').write(
+        '{"heading": {"message": "Geändert"}}',
+    )
+    content = get_page_content(source, 'de', 'child')
+    assert '<h1>Geändert</h1>' in content['body']
+    assert rendered_pages == [('de', 'child'), ('de', 'child')]
+
+
+def test_head_only(site_dir):
+    source = create_source(site_dir.strpath)
+    full = get_page_content(source, 'de', 'child')
+    head_only = get_page_content(source, 'de', 'child', head_only=True)
+
+    assert head_only['head'] == full['head']
+    assert head_only['title'] == 'Child'
+    assert 'body' not in head_only
+    assert 'translation_ratio' not in head_only
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_blacklisted_link_target(site_dir, tmpdir, jobs):
+    site_dir.join('pages', 'child.md').write(CHILD + '\n[Other](other)\n')
+    site_dir.join('pages', 'other.md').write('{{a A}} {{b B}} {{c C}} {{d D}}')
+    # Not translated enough for the page to be generated
+    site_dir.join('locales', 'de', 'other.json').write(
+        '{"a": {"message": "A"}}',
+    )
+    out_dir = tmpdir.mkdir('out')
+    generate_pages(site_dir.strpath, out_dir.strpath, jobs=jobs)
+
+    # The content of the child page is rendered while calculating the
+    # translation ratios, but must link to pages that are generated.
+    assert not out_dir.join('de', 'other').exists()
+    assert 'href="/en/other"' in out_dir.join('de', 'index').read()
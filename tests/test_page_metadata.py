@@ -0,0 +1,153 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+
+import mock
+import pytest
+
+from cms import sources
+from cms.sources import FileSource, PageMetadataIndex, create_source
+from cms.utils import extract_page_metadata
+
+from .conftest import ROOTPATH
+
+SITE_PATH = os.path.join(ROOTPATH, 'tests', 'test_site')
+
+VALUES = ['a', 'b', 'c', 1, 1.0, True, None, ['a'], ['a', 'b'], ['b', 1],
+          [], {'a': 1}]
+
+
+def filter_metadata(filters, metadata):
+    # How filters were applied to the metadata of every page before
+    if filters is None:
+        return True
+    for filter_name, filter_value in list(filters.items()):
+        if filter_name not in metadata:
+            return False
+        if isinstance(metadata[filter_name], list):
+            if isinstance(filter_value, str):
+                filter_value = [filter_value]
+            for option in filter_value:
+                if str(option) not in metadata[filter_name]:
+                    return False
+        elif filter_value != metadata[filter_name]:
+            return False
+    return True
+
+
+@pytest.fixture
+def site_dir(tmpdir):
+    site_dir = tmpdir.mkdir('site')
+    site_dir.join('settings.ini').write('')
+    pages = site_dir.mkdir('pages')
+    pages.join('foo.md').write('tags = [a, b]\n\nFoo')
+    pages.join('bar.tmpl').write('<!-- {"tags": ["b"]} -->\nBar')
+    return site_dir
+
+
+def test_random_filters():
+    rng = random.Random(0)
+    for i in range(200):
+        pages = [
+            ('page{}'.format(j), {name: rng.choice(VALUES)
+                                  for name in rng.sample('xyz', 2)})
+            for j in range(10)
+        ]
+        index = PageMetadataIndex(pages)
+        for j in range(20):
+            filters = {name: rng.choice(VALUES[:-1])
+                       for name in rng.sample('xyz', rng.randint(0, 2))}
+            expected = []
+            try:
+                for page, metadata in pages:
+                    metadata = dict(metadata, page=page)
+                    if filter_metadata(filters, metadata):
+                        expected.append(metadata)
+            except TypeError:
+                # Single values other than strings couldn't filter lists
+                index.filter(filters)
+            else:
+                assert index.filter(filters) == expected, filters
+
+
+def test_filter_returns_copies():
+    index = PageMetadataIndex([('foo', {'tags': ['a']})])
+    index.filter()[0]['tags'] = 'modified'
+    assert index.filter({'tags': 'a'}) == [{'page': 'foo', 'tags': ['a']}]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_page_heads(chunk_size):
+    source = FileSource(SITE_PATH)
+    with mock.patch.object(sources, 'HEAD_CHUNK_SIZE', chunk_size):
+        for page, format in source.list_pages():
+            data = source.read_page(page, format)[0]
+            head = source.read_page_head(page, format)
+            assert data.startswith(head)
+            assert (extract_page_metadata(head)[0] ==
+                    extract_page_metadata(data)[0])
+
+
+@pytest.mark.parametrize('data', [
+    '',
+    'Foo',
+    'foo = bar\nbaz = [a, b]\n\nFoo',
+    '  \n <!-- foo = bar -->\nbaz = qux',
+    '<!-- {"foo": "bar"} -->',
+    '<!-- foo = bar',
+    '{"foo": "bar", "baz": [1, 2]}\nFoo',
+    '{% extends "foo" %}\nfoo = bar',
+])
+def test_page_head_edge_cases(tmpdir, data):
+    tmpdir.mkdir('pages').join('foo.md').write(data)
+    source = FileSource(tmpdir.strpath)
+    with mock.patch.object(sources, 'HEAD_CHUNK_SIZE', 3):
+        head = source.read_page_head('foo', 'md')
+    assert extract_page_metadata(head)[0] == extract_page_metadata(data)[0]
+
+
+def test_index_is_reused(site_dir):
+    source = create_source(site_dir.strpath)
+    index = source.read_pages_metadata()
+    assert [m['page'] for m in index.filter({'tags': 'b'})] == ['bar', 'foo']
+    assert [m['page'] for m in index.filter({'tags': ['a']})] == ['foo']
+
+    with mock.patch.object(source, 'read_file') as read_file:
+        assert source.read_pages_metadata() is index
+        read_file.assert_not_called()
+
+    site_dir.join('pages', 'foo.md').write('tags = [c]\n\nModified foo')
+    index = source.read_pages_metadata()
+    assert [m['page'] for m in index.filter({'tags': 'b'})] == ['bar']
+
+    site_dir.join('pages', 'baz.md').write('tags = [b]')
+    index = source.read_pages_metadata()
+    assert [m['page'] for m in index.filter({'tags': 'b'})] == ['bar', 'baz']
+
+
+def test_index_dependencies(site_dir):
+    source = create_source(site_dir.strpath)
+    for i in range(2):
+        with source.dependencies.capture() as dependencies:
+            source.read_pages_metadata(True)
+        assert dependencies == {'pages/', 'pages/foo.md', 'pages/bar.tmpl'}
+
+
+def test_single_value_filters_lists():
+    index = PageMetadataIndex([('foo', {'versions': ['1', '2']}),
+                               ('bar', {'versions': '1'})])
+    assert [m['page'] for m in index.filter({'versions': 2})] == ['foo']
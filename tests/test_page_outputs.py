@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import os
 import sys
@@ -8,7 +9,7 @@ import pytest
 
 from .conftest import ROOTPATH
 from .utils import get_dir_contents, exception_test
-from cms.sources import FileSource
+from cms.sources import FileSource, create_source
 from cms.bin.test_server import DynamicServerHandler
 
 
@@ -45,6 +46,11 @@ def output_pages_relative(temp_site, tmpdir_factory):
     return generate_static_pages(temp_site, tmpdir_factory, '--relative')
 
 
+@pytest.fixture(scope='session')
+def output_pages_parallel(temp_site, tmpdir_factory):
+    return generate_static_pages(temp_site, tmpdir_factory, '--jobs', '2')
+
+
 @pytest.mark.parametrize('filename,expected_output', static_expected_outputs)
 def test_static(output_pages, filename, expected_output):
     if expected_output.startswith('## MISSING'):
@@ -61,6 +67,32 @@ def test_static_relative(output_pages_relative, filename, expected_output):
         assert expected_output == output_pages_relative[filename]
 
 
+def test_static_parallel(output_pages, output_pages_parallel):
+    assert output_pages_parallel == output_pages
+
+
+def test_static_fingerprint(temp_site, tmpdir_factory):
+    output_pages = generate_static_pages(temp_site, tmpdir_factory,
+                                         '--fingerprint')
+    # static/img/icon is empty, so its fingerprint is the hash of no data.
+    assert '<img src="/img/icon?da39a3ee5e">' in output_pages['en/rel_path']
+    # Links to files that aren't in static/ are left alone.
+    assert '<script src="/scripts/myscript.js">' in output_pages['en/rel_path']
+
+
+def test_static_fingerprint_is_hashed_in_chunks(tmpdir):
+    tmpdir.join('settings.ini').write('')
+    tmpdir.join('static', 'file').write(b'0123456789', 'wb', ensure=True)
+    source = create_source(tmpdir.strpath)
+    with mock.patch('cms.sources.HASH_CHUNK_SIZE', 3), \
+            mock.patch.object(source, 'read_file') as read_file, \
+            source.dependencies.capture() as dependencies:
+        fingerprint = source.get_static_fingerprint('file')
+    assert fingerprint == hashlib.sha1(b'0123456789').hexdigest()[:10]
+    assert dependencies == {'static/file'}
+    read_file.assert_not_called()
+
+
 def test_cache(output_pages):
     source = FileSource(os.path.join('test_site'))
     assert source.get_cache_dir() == os.path.join('test_site', 'cache')
@@ -69,14 +101,14 @@ def test_cache(output_pages):
 def test_broken_link_warnings(temp_site, tmpdir_factory, caplog):
     caplog.set_level(logging.WARNING)
     generate_static_pages(temp_site, tmpdir_factory)
-    messages = {t[2] for t in caplog.record_tuples}
-    expected_messages = [
-        'Link from "brokenlink" to "missing" cannot be resolved',
-        'Link from "brokenlink-html" to "missing" cannot be resolved',
-        'Link from "brokenlink-tmpl" to "missing" cannot be resolved',
-    ]
-    for message in expected_messages:
-        assert message in messages
+    messages = [t[2] for t in caplog.record_tuples
+                if 'cannot be resolved' in t[2]]
+    # All links are reported at once
+    assert len(messages) == 1
+    lines = messages[0].split('\n')
+    assert lines[0] == '3 link targets cannot be resolved:'
+    assert ('  "missing" from "brokenlink", "brokenlink-html", '
+            '"brokenlink-tmpl"') in lines
 
 
 @pytest.mark.parametrize('filename,expected_output', dynamic_expected_outputs)
@@ -0,0 +1,158 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+
+import mock
+import pytest
+
+from cms import utils
+
+from .utils import request
+
+
+@pytest.fixture
+def server_site(server_site):
+    server_site.join('templates', 'default.tmpl').write(
+        '<title>{{ title }}</title>{{ body|safe }}',
+    )
+    server_site.join('pages', 'index.md').write(
+        'title = Index\n\n{{greeting Hello}}',
+    )
+    server_site.join('locales', 'de', 'index.json').write(
+        '{"greeting": {"message": "Hallo"}}', ensure=True,
+    )
+    server_site.join('static', 'style.css').write('body {}')
+    return server_site
+
+
+@pytest.fixture
+def process_page():
+    with mock.patch('cms.bin.test_server.process_page',
+                    side_effect=utils.process_page) as process_page:
+        yield process_page
+
+
+def get(handler, path):
+    status, headers, data = request(handler, path)
+    return status, data.decode('utf-8')
+
+
+def modify(path, data):
+    path.write(data)
+    # Make sure that the signature changes, despite coarse timestamps
+    os.utime(path.strpath, ns=(0, 0))
+
+
+def test_unchanged_page_is_cached(handler, process_page):
+    assert get(handler, '/de/') == ('200 OK',
+                                    '<title>Index</title><p>Hallo</p>')
+    assert get(handler, '/de/') == ('200 OK',
+                                    '<title>Index</title><p>Hallo</p>')
+    assert process_page.call_count == 1
+
+    get(handler, '/en/')
+    assert process_page.call_count == 2
+
+
+@pytest.mark.parametrize('filename,data,expected', [
+    ('pages/index.md', 'title = Changed\n\n{{greeting Hello}}',
+     '<title>Changed</title><p>Hallo</p>'),
+    ('locales/de/index.json', '{"greeting": {"message": "Servus"}}',
+     '<title>Index</title><p>Servus</p>'),
+    ('templates/default.tmpl', '{{ body|safe }}', '<p>Hallo</p>'),
+])
+def test_changes_are_picked_up(server_site, handler, process_page, filename,
+                               data, expected):
+    get(handler, '/de/')
+    modify(server_site.join(*filename.split('/')), data)
+    assert get(handler, '/de/') == ('200 OK', expected)
+    assert process_page.call_count == 2
+
+
+def test_static_files(server_site, handler):
+    assert get(handler, '/style.css')[1] == 'body {}'
+    modify(server_site.join('static', 'style.css'), 'body {color: red}')
+    assert get(handler, '/style.css')[1] == 'body {color: red}'
+
+
+def test_new_conflicting_page(server_site, handler):
+    get(handler, '/en/foo')
+    server_site.join('pages', 'foo.md').write('foo')
+    assert get(handler, '/en/foo') == ('200 OK', '<title></title><p>foo</p>')
+
+    server_site.join('pages', 'foo', 'bar.md').write('bar', ensure=True)
+    with pytest.raises(Exception, match='conflicts'):
+        get(handler, '/en/foo')
+
+
+def test_validators(handler):
+    status, headers, data = request(handler, '/style.css')
+    assert headers['ETag'] == '"{}"'.format(
+        hashlib.sha1(b'body {}').hexdigest(),
+    )
+    assert headers['Last-Modified'].endswith(' GMT')
+
+    page_headers = request(handler, '/de/')[1]
+    assert page_headers['ETag'] == request(handler, '/de/')[1]['ETag']
+    assert page_headers['ETag'] != request(handler, '/en/')[1]['ETag']
+
+
+@pytest.mark.parametrize('path', ['/de/', '/style.css'])
+def test_not_modified(handler, process_page, path):
+    headers = request(handler, path)[1]
+    # The response body doesn't need to be kept for the validators to work
+    handler._responses.clear()
+
+    for conditions in [{'if_none_match': headers['ETag']},
+                       {'if_none_match': 'W/' + headers['ETag']},
+                       {'if_none_match': '"foo", ' + headers['ETag']},
+                       {'if_none_match': '*'},
+                       {'if_modified_since': headers['Last-Modified']}]:
+        status, response_headers, data = request(handler, path, **conditions)
+        assert (status, data) == ('304 Not Modified', b'')
+        assert response_headers == {'ETag': headers['ETag'],
+                                    'Last-Modified': headers['Last-Modified'],
+                                    'Vary': 'Accept-Encoding'}
+    assert process_page.call_count == (1 if path == '/de/' else 0)
+
+    for conditions in [{'if_none_match': '"foo"'},
+                       {'if_modified_since': 'Thu, 01 Jan 1970 00:00:00 GMT'},
+                       {'if_modified_since': 'invalid'},
+                       # If-Modified-Since is ignored along with If-None-Match
+                       {'if_none_match': '"foo"',
+                        'if_modified_since': headers['Last-Modified']}]:
+        assert request(handler, path, **conditions)[0] == '200 OK'
+
+
+@pytest.mark.parametrize('filename,path', [
+    ('locales/de/index.json', '/de/'),
+    ('static/style.css', '/style.css'),
+])
+def test_modified(server_site, handler, filename, path):
+    headers = request(handler, path)[1]
+    modify(server_site.join(*filename.split('/')), '{}')
+
+    status, new_headers, data = request(
+        handler, path, if_none_match=headers['ETag'],
+        if_modified_since=headers['Last-Modified'],
+    )
+    assert status == '200 OK'
+    assert new_headers['ETag'] != headers['ETag']
+
+    status = request(handler, path,
+                     if_modified_since=headers['Last-Modified'])[0]
+    assert status == '200 OK'
@@ -0,0 +1,70 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import configparser
+
+import pytest
+
+from cms.sources import FileSource
+
+
+@pytest.fixture
+def source(tmpdir):
+    tmpdir.join('settings.ini').write(
+        '[general]\n'
+        'defaultlocale = en\n'
+        'defaultpage = index\n'
+        '[locale_overrides]\n'
+        'foo/bar = baz\n',
+    )
+    return FileSource(tmpdir.strpath)
+
+
+def test_precomputed_values(source):
+    config = source.read_config()
+    assert config.defaultlocale == 'en'
+    assert config.defaultpage == 'index'
+    assert config.get_locale_file('foo/bar') == 'baz'
+    assert config.get_locale_file('foo') == 'foo'
+    assert source.locale_filename('de', 'foo/bar') == 'locales/de/baz.json'
+
+
+def test_missing_defaults(tmpdir):
+    tmpdir.join('settings.ini').write('[general]\n')
+    config = FileSource(tmpdir.strpath).read_config()
+    with pytest.raises(configparser.NoOptionError):
+        config.defaultlocale
+
+
+def test_config_is_reused_until_changed(source):
+    config = source.read_config()
+    assert source.read_config() is config
+
+    source.write_to_config('general', 'defaultlocale', 'de')
+    new_config = source.read_config()
+    assert new_config is not config
+    assert new_config.defaultlocale == 'de'
+    assert new_config.get('general', 'defaultpage') == 'index'
+
+
+def test_config_is_read_only(source):
+    config = source.read_config()
+    with pytest.raises(TypeError):
+        config.set('general', 'defaultlocale', 'de')
+    with pytest.raises(TypeError):
+        config.add_section('foo')
+    with pytest.raises(TypeError):
+        config.remove_section('general')
+    assert config.defaultlocale == 'en'
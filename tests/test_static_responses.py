@@ -0,0 +1,118 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+from wsgiref.util import FileWrapper
+
+import mock
+import pytest
+
+from cms.bin.test_server import parse_byte_range
+
+from .utils import request
+
+CONTENTS = b'0123456789'
+
+
+@pytest.fixture
+def server_site(server_site):
+    server_site.join('static', 'file.bin').write(CONTENTS, 'wb')
+    return server_site
+
+
+@pytest.mark.parametrize('header,expected', [
+    ('bytes=2-5', (2, 6)),
+    ('bytes=5-', (5, 10)),
+    ('bytes=-3', (7, 10)),
+    ('bytes=-20', (0, 10)),
+    ('bytes=8-20', (8, 10)),
+    (' bytes=0-0 ', (0, 1)),
+    ('bytes=1-2,4-5', None),
+    ('bytes=5-2', None),
+    ('bytes=-', None),
+    ('bytes=a-b', None),
+    ('items=1-2', None),
+])
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, len(CONTENTS)) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=10-', 'bytes=-0'])
+def test_parse_unsatisfiable_byte_range(header):
+    with pytest.raises(ValueError):
+        parse_byte_range(header, len(CONTENTS))
+
+
+def test_file_wrapper(handler):
+    file_wrapper = mock.Mock(side_effect=FileWrapper)
+    status, headers, data = request(handler, '/file.bin',
+                                    {'wsgi.file_wrapper': file_wrapper})
+    assert (status, data) == ('200 OK', CONTENTS)
+    assert headers['Content-Length'] == str(len(CONTENTS))
+    assert headers['Accept-Ranges'] == 'bytes'
+    assert file_wrapper.call_count == 1
+
+
+def test_chunks(handler):
+    with mock.patch('cms.bin.test_server.STATIC_CHUNK_SIZE', 3):
+        response = handler({'PATH_INFO': '/file.bin'}, lambda *args: None)
+        assert list(response) == [b'012', b'345', b'678', b'9']
+    response.close()
+
+
+@pytest.mark.parametrize('header,content_range,expected', [
+    ('bytes=2-5', 'bytes 2-5/10', b'2345'),
+    ('bytes=-3', 'bytes 7-9/10', b'789'),
+    ('bytes=8-100', 'bytes 8-9/10', b'89'),
+])
+def test_range(handler, header, content_range, expected):
+    status, headers, data = request(handler, '/file.bin', range=header)
+    assert (status, data) == ('206 Partial Content', expected)
+    assert headers['Content-Range'] == content_range
+    assert headers['Content-Length'] == str(len(expected))
+
+
+def test_range_not_satisfiable(handler):
+    status, headers, data = request(handler, '/file.bin',
+                                    range='bytes=10-')
+    assert (status, data) == ('416 Range Not Satisfiable', b'')
+    assert headers['Content-Range'] == 'bytes */10'
+
+
+def test_if_range(handler):
+    headers = request(handler, '/file.bin')[1]
+    for if_range, expected in [(headers['ETag'], '206 Partial Content'),
+                               (headers['Last-Modified'],
+                                '206 Partial Content'),
+                               ('"outdated"', '200 OK'),
+                               ('W/' + headers['ETag'], '200 OK')]:
+        status = request(handler, '/file.bin', range='bytes=2-5',
+                         if_range=if_range)[0]
+        assert status == expected
+
+
+def test_file_is_closed(handler):
+    files = []
+    orig_open_file = handler.source.open_file
+
+    def open_file(filename):
+        files.append(orig_open_file(filename))
+        return files[-1]
+
+    with mock.patch.object(handler.source, 'open_file', open_file):
+        request(handler, '/file.bin')
+        request(handler, '/file.bin', range='bytes=2-5')
+        request(handler, '/file.bin', range='bytes=10-')
+    assert len(files) == 3
+    assert all(file.closed for file in files)
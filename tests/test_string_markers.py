@@ -0,0 +1,94 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+import re
+
+import pytest
+
+from cms.converters import find_string_markers
+
+from .conftest import ROOTPATH
+
+# The regular expression previously used to find the markers
+LEGACY_REGEX = re.compile(
+    r'{{\s*'
+    r'([\w\-]+)'  # String ID
+    r'(?:(?:\[(.*?)\])?'  # Optional comment
+    r'\s+'
+    r'((?:(?!{{).|'  # Translatable text
+    r'{{(?:(?!}}).)*}}'  # Nested translation
+    r')*?)'
+    r')?'
+    r'}}',
+    flags=re.S,
+)
+
+SITE_PATH = os.path.join(ROOTPATH, 'tests', 'test_site')
+
+TOKENS = ['{{', '}}', '{', '}', '[', ']', ' ', '\n', '\xa0', 'id', 'a-b',
+          '_', 'é', 'text', '{{ foo ', '{{bar[', ']] ', '}}}']
+
+
+def legacy_markers(text):
+    return [(match.start(), match.end()) + match.groups()
+            for match in LEGACY_REGEX.finditer(text)]
+
+
+def site_files():
+    for dirname in ['pages', 'includes', 'templates']:
+        for root, dirs, files in os.walk(os.path.join(SITE_PATH, dirname)):
+            for filename in files:
+                yield os.path.join(root, filename)
+
+
+@pytest.mark.parametrize('path', sorted(site_files()))
+def test_site_files(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    assert list(find_string_markers(text)) == legacy_markers(text)
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    '{{foo}}',
+    '{{ foo }}',
+    '{{foo Default}}',
+    '{{foo[Comment] Default}}',
+    '{{foo[Comment]Default}}',
+    '{{foo[] }}',
+    '{{foo[a] b] c}}',
+    '{{foo[a]b] c}}',
+    '{{foo[a] {{b}} c}} d}}',
+    '{{foo {{bar}}',
+    '{{foo {{bar baz}} qux}} }}',
+    '{{foo {{bar}',
+    '{{{foo}}}',
+    '{{ {{foo}}',
+    '{{foo\n[x]\ny\n}}',
+    '{{foo }}}',
+    '{{foo-bar_1 text}} and {{baz text}}',
+])
+def test_examples(text):
+    assert list(find_string_markers(text)) == legacy_markers(text)
+
+
+def test_random_texts():
+    rng = random.Random(0)
+    for i in range(5000):
+        text = ''.join(rng.choice(TOKENS)
+                       for j in range(rng.randrange(30)))
+        assert list(find_string_markers(text)) == legacy_markers(text), text
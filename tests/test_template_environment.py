@@ -0,0 +1,143 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import gc
+import os
+import weakref
+
+import mock
+import pytest
+
+from cms.converters import get_template_environment, get_template_variables
+from cms.sources import create_source
+from cms.utils import process_page
+
+
+@pytest.fixture
+def site_dir(tmpdir):
+    tmpdir.join('settings.ini').write(
+        '[general]\ndefaultlocale = en\ndefaultpage = index\n',
+    )
+    tmpdir.mkdir('templates').join('default.tmpl').write('{{ body|safe }}')
+    tmpdir.mkdir('pages').join('index.tmpl').write(
+        '{{ "x"|shout }} {{ get_string("hello") }}',
+    )
+    for locale, message in [('en', 'Hello'), ('de', 'Hallo')]:
+        tmpdir.join('locales', locale, 'index.json').write(
+            '{"hello": {"message": "%s"}}' % message, ensure=True,
+        )
+    tmpdir.mkdir('filters').join('shout.py').write(
+        'def shout(s):\n    return s.upper()\n',
+    )
+    return tmpdir
+
+
+def test_environment_is_shared(site_dir):
+    source = create_source(site_dir.strpath)
+    env = get_template_environment(source)
+    assert get_template_environment(source) is env
+    assert process_page(source, 'en', 'index') == 'X Hello'
+    assert process_page(source, 'de', 'index') == 'X Hallo'
+
+
+def test_filters_with_constant_arguments(site_dir):
+    # Templates compiled while another page is rendered must not use the
+    # converter of that page.
+    site_dir.join('pages', 'index.tmpl').write(
+        '{{ get_page_content("other").body|safe }}',
+    )
+    site_dir.join('pages', 'other.tmpl').write(
+        '{{ "Hello"|translate("hello") }} {{ "other"|linkify }}</a>',
+    )
+    for locale, message in [('en', 'Hello'), ('de', 'Hallo')]:
+        site_dir.join('locales', locale, 'other.json').write(
+            '{"hello": {"message": "%s"}}' % message,
+        )
+    source = create_source(site_dir.strpath)
+    assert process_page(source, 'en', 'index') == \
+        'Hello <a href="/en/other" hreflang="en"></a>'
+    assert process_page(source, 'de', 'index') == \
+        'Hallo <a href="/de/other" hreflang="de"></a>'
+
+    env = get_template_environment(source)
+    other = site_dir.join('pages', 'other.tmpl').read()
+    assert get_template_variables(env, other) is not None
+
+
+def test_changed_filter(site_dir):
+    source = create_source(site_dir.strpath)
+    env = get_template_environment(source)
+    assert process_page(source, 'en', 'index') == 'X Hello'
+
+    path = site_dir.join('filters', 'shout.py')
+    path.write('def shout(s):\n    return s.upper() + "!"\n')
+    os.utime(path.strpath, ns=(0, 0))
+
+    assert get_template_environment(source) is not env
+    assert process_page(source, 'en', 'index') == 'X! Hello'
+
+    # Templates compiled with the previous filter aren't used after restarts
+    source = create_source(site_dir.strpath)
+    assert process_page(source, 'en', 'index') == 'X! Hello'
+
+
+def test_filter_dependencies(site_dir):
+    source = create_source(site_dir.strpath)
+    get_template_environment(source)
+
+    with source.dependencies.capture() as dependencies:
+        get_template_environment(source)
+    assert 'filters/shout.py' in dependencies
+
+
+def test_changed_imported_template(site_dir):
+    site_dir.join('templates', 'macros.tmpl').write(
+        '{% macro greet() %}Hi{% endmacro %}',
+    )
+    site_dir.join('pages', 'index.tmpl').write(
+        '{% import "templates/macros" as m %}{{ m.greet() }}',
+    )
+    source = create_source(site_dir.strpath)
+    assert process_page(source, 'en', 'index') == 'Hi'
+
+    path = site_dir.join('templates', 'macros.tmpl')
+    path.write('{% macro greet() %}Hey{% endmacro %}')
+    os.utime(path.strpath, ns=(0, 0))
+    assert process_page(source, 'en', 'index') == 'Hey'
+
+    with source.dependencies.capture() as dependencies:
+        process_page(source, 'en', 'index')
+    assert 'templates/macros.tmpl' in dependencies
+
+
+def test_bytecode_cache(site_dir):
+    process_page(create_source(site_dir.strpath), 'en', 'index')
+    assert site_dir.join('cache', 'jinja2').listdir()
+
+    # A new source (e.g. in another process) uses the compiled templates.
+    source = create_source(site_dir.strpath)
+    with mock.patch('jinja2.Environment.compile') as compile:
+        assert process_page(source, 'en', 'index') == 'X Hello'
+    compile.assert_not_called()
+
+
+def test_source_is_collected(site_dir):
+    source = create_source(site_dir.strpath)
+    assert process_page(source, 'en', 'index') == 'X Hello'
+
+    ref = weakref.ref(source)
+    del source
+    gc.collect()
+    assert ref() is None
@@ -0,0 +1,53 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+
+import markdown
+import mock
+import pytest
+
+from cms import converters
+from cms.sources import FileSource, create_source
+from cms.utils import get_page_params, get_translation_ratio
+
+from .conftest import ROOTPATH
+
+SITE_PATH = os.path.join(ROOTPATH, 'tests', 'test_site')
+PAGES = sorted(FileSource(SITE_PATH).list_pages())
+
+
+@pytest.fixture(scope='module')
+def source(tmpdir_factory):
+    # Rendering pages writes to the cache directory of the website
+    site_dir = tmpdir_factory.mktemp('site').join('test_site').strpath
+    shutil.copytree(SITE_PATH, site_dir)
+    return create_source(site_dir)
+
+
+@pytest.mark.parametrize('page,format', PAGES)
+def test_translation_ratio(source, page, format):
+    expected = get_page_params(source, 'de', page, format)['translation_ratio']
+
+    with mock.patch.object(markdown.Markdown, 'convert', autospec=True,
+                           side_effect=markdown.Markdown.convert) as convert, \
+            mock.patch('cms.converters.process_links',
+                       side_effect=converters.process_links) as process_links:
+        ratio = get_translation_ratio(source, 'de', page, format)
+
+    assert ratio == expected
+    convert.assert_not_called()
+    process_links.assert_not_called()
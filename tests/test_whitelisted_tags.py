@@ -0,0 +1,94 @@
+# This file is part of the Adblock Plus web scripts,
+# Copyright (C) 2006-present eyeo GmbH
+#
+# Adblock Plus is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# Adblock Plus is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Adblock Plus.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import re
+
+import pytest
+
+from cms.converters import WhitelistedTags, html_escapes
+
+TAGS = ('a', 'abbr', 'em')
+
+
+def insert_attributes_with_regexes(text, tags, escapes, attributes):
+    """Insert attributes the way `localize_string` used to."""
+    def re_escape(s):
+        return re.escape(''.join(escapes.get(c, c) for c in s))
+
+    for tag in tags:
+        allowed_contents = '(?:[^<>]|{})'.format('|'.join(
+            '<(?:{}[^<>]*?|/{})>'.format(t, t)
+            for t in map(re.escape, set(tags) - {tag})
+        ))
+        pattern = r'{}({}*?){}'.format(re_escape('<{}>'.format(tag)),
+                                       allowed_contents,
+                                       re_escape('</{}>'.format(tag)))
+        for attrs in attributes.get(tag, []):
+            text = re.sub(
+                pattern,
+                lambda match: '<{}{}>{}</{}>'.format(tag, attrs,
+                                                     match.group(1), tag),
+                text, 1, flags=re.S,
+            )
+        text = re.sub(pattern, r'<{}>\1</{}>'.format(tag, tag), text,
+                      flags=re.S)
+    return text
+
+
+def random_case(rng, escapes):
+    def escape(s):
+        return ''.join(escapes.get(c, c) for c in s)
+
+    pieces = ['x', ' ', '\n', escape('<b>')]
+    for tag in TAGS:
+        pieces += [escape('<{}>'.format(tag)), escape('</{}>'.format(tag))]
+    text = ''.join(rng.choice(pieces) for i in range(rng.randint(0, 12)))
+
+    attributes = {}
+    for tag in TAGS:
+        attributes[tag] = []
+        for i in range(rng.randint(0, 3)):
+            if rng.random() < 0.02:
+                # Attribute values that look like tags themselves
+                value = escape('<{}>'.format(rng.choice(TAGS)))
+            else:
+                value = str(i)
+            attributes[tag].append(
+                rng.choice(['', ' title="{}"'.format(value)]),
+            )
+    return text, attributes
+
+
+@pytest.mark.parametrize('escapes', [html_escapes, {}])
+def test_same_as_regexes(escapes):
+    rng = random.Random(42)
+    for i in range(3000):
+        tags = tuple(rng.sample(TAGS, len(TAGS)))
+        text, attributes = random_case(rng, escapes)
+        expected = insert_attributes_with_regexes(text, tags, escapes,
+                                                  attributes)
+        result = WhitelistedTags(tags, escapes).insert_attributes(text,
+                                                                  attributes)
+        assert result == expected, (tags, text, attributes)
+
+
+def test_nested_tags():
+    tags = WhitelistedTags(('a', 'em'), html_escapes)
+    text = ('&lt;a&gt;foo &lt;em&gt;bar&lt;/em&gt;&lt;/a&gt; '
+            '&lt;a&gt;baz&lt;/a&gt;')
+    assert tags.insert_attributes(text, {'a': [' href="1"', ' href="2"']}) == (
+        '<a href="1">foo <em>bar</em></a> <a href="2">baz</a>'
+    )
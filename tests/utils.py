@@ -100,6 +100,42 @@ def _wait_for_server():
                 raise
 
 
+def request(handler, path, environ=None, **headers):
+    """Send a request to a WSGI handler, e.g. `DynamicServerHandler`.
+
+    Parameters
+    ----------
+    handler: callable
+        The WSGI application handling the request.
+    path: str
+        The requested path.
+    environ: dict
+        Additional WSGI environment variables.
+    headers: dict
+        The request headers, with underscores in place of dashes, e.g.
+        `if_none_match`.
+
+    Returns
+    -------
+    (status, headers, data): (str, dict, bytes)
+        The response.
+
+    """
+    environ = dict(environ or {}, PATH_INFO=path)
+    for name, value in headers.items():
+        environ['HTTP_' + name.upper()] = value
+
+    responses = []
+    response = handler(environ, lambda *args: responses.append(args))
+    try:
+        data = b''.join(response)
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    status, response_headers = responses[0]
+    return status, dict(response_headers), data
+
+
 def create_in_memory_zip(file_names, file_data):
     """Create a BytesIO object with the contents of a zip file.
 